@@ -0,0 +1,101 @@
+import os
+import time
+import hashlib
+import tempfile
+
+
+class BlobStore:
+    """
+    Content-addressed store of the files backups. Every blob is a file named by the SHA-256 of its content, under
+    fan-out subdirectories of the hash prefix (ab/cd/abcd...) so no directory grows too large.
+    Blobs are written and read in chunks, so a backup never has to be held twice in memory
+    """
+    chunk_size = 1 << 20
+    fan_out = 2     # number of subdirectory levels, each named by the next 2 hex digits of the hash
+    temp_prefix = 'tmp-'
+    collect_min_age = 3600  # seconds - younger files may belong to a write in progress and are never collected
+
+    def __init__(self, root: str):
+        """
+        :param root: the directory of the store
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """
+        :param digest: the blob hash
+        :return: the path to the blob
+        """
+        return os.path.join(self.root, *(digest[2 * i: 2 * i + 2] for i in range(BlobStore.fan_out)), digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.isfile(self.path(digest))
+
+    def write(self, chunks) -> str:
+        """
+        Stream a blob into the store. Identical contents are stored once
+        :param chunks: an iterable of bytes
+        :return: the blob hash
+        """
+        sha = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(prefix=BlobStore.temp_prefix, dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    file.write(chunk)
+            digest = sha.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)     # the blob appears complete or not at all
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    def read(self, digest: str):
+        """
+        Stream a blob from the store
+        :param digest: the blob hash
+        :return: a generator of the blob's chunks
+        """
+        with open(self.path(digest), 'rb') as file:
+            while chunk := file.read(BlobStore.chunk_size):
+                yield chunk
+
+    def remove(self, digest: str):
+        """
+        Remove a blob if it is in the store
+        :param digest: the blob hash
+        """
+        if self.exists(digest):
+            os.remove(self.path(digest))
+
+    def collect(self, referenced: set) -> int:
+        """
+        Garbage collection - remove the blobs which are not referenced and the leftovers of interrupted writes.
+        The files younger than collect_min_age are kept, they may be written or not yet referenced by another
+        process. The files which cannot be removed (e.g. open on Windows) are left for the next collection
+        :param referenced: the hashes of the blobs in use
+        :return: the number of removed files
+        """
+        removed = 0
+        oldest = time.time() - BlobStore.collect_min_age
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name in referenced:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) > oldest:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+        return removed
@@ -13,9 +13,10 @@ class Camera:
     freeze_color = (0, 255, 0)
     retake_time = 2
 
-    def __init__(self):
+    def __init__(self, tracker=None):
         """
         Initialize the Camera for scanning
+        :param tracker: a FaceTracker object following the faces of the preview, no tracking if not specified
         """
         self._v_cap = cv.VideoCapture(0)
         if self._v_cap is None:
@@ -23,6 +24,7 @@ class Camera:
 
         self._pic = None
         self._last_frame = None
+        self.tracker = tracker
 
     def run(self):
         """
@@ -31,8 +33,12 @@ class Camera:
         Logger(msg.Info.take_pic, Logger.message).log()
         Logger(msg.Info.pic_instruction, Logger.warning).log()
 
+        if self.tracker is not None:
+            self.tracker.reset()
         while True:
             self.read_stream()
+            if self.tracker is not None:
+                self.tracker.update(self._pic)
             image = self.prepare_presentation()
             cv.imshow(Camera.window_name, image)
             key = cv.waitKey(1)
@@ -71,6 +77,9 @@ class Camera:
         Resize image for later presentation
         """
         image = self._pic.copy()
+        if self.tracker is not None:
+            for x1, y1, x2, y2 in self.tracker.boxes:
+                cv.rectangle(image, (x1, y1), (x2, y2), Camera.freeze_color, 1)
         h, w, _ = image.shape
         cv.resize(image, (int(Camera.default_size * w/h), Camera.default_size))
         return image
@@ -85,3 +94,9 @@ class Camera:
 
     def get_pic(self):
         return self._pic.copy()
+
+    def get_boxes(self):
+        """
+        :return: the tracked face bounding boxes of the captured frame if they are trusted, None otherwise
+        """
+        return self.tracker.confident_boxes() if self.tracker is not None else None
@@ -1,7 +1,9 @@
 import sqlite3
 import os
+import ntpath
 import bz2 as bz
 import struct
+import hashlib
 from tqdm import tqdm
 import numpy as np
 import cv2 as cv
@@ -10,7 +12,9 @@ from encryption import Encryption
 from utils.logger import Logger
 from utils.messages import Messages as msg
 from terminal_ui.keys import KeyMap
-from model.SNN import Net
+import model.config as config
+from gallery import Gallery, MemmapGallery
+from blob_store import BlobStore
 # could not import the User bcs of circular input...
 
 
@@ -18,9 +22,30 @@ class Database:
     parent_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases')
     org_path = os.path.join(parent_dir, r'database.db')
     locked_path = os.path.join(parent_dir, r'database.locked')
+    blobs_path = os.path.join(parent_dir, r'blobs')     # the files backups, referenced by hash from the files table
     file_state_open = 1
     file_state_locked = 0
 
+    # 'float16' or 'uint8' (per-vector scaled) store the embeddings of new users compressed, in the DB and in memory
+    embedding_dtype = 'float32'
+
+    # set to 'float32' or 'float16' to keep the embeddings in a memory-mapped sidecar store next to the DB.
+    # The sidecar holds the embeddings the file keys are derived from, so it exists only while the DB is decrypted -
+    # it is rebuilt from the DB when opened and deleted when the DB is encrypted back
+    sidecar_dtype = None
+    sidecar_matrix_path = os.path.join(parent_dir, r'embeddings.matrix')
+    sidecar_locked_path = os.path.join(parent_dir, r'embeddings.locked')     # the encrypted sidecar of old versions
+    sidecar_index_path = os.path.join(parent_dir, r'embeddings.index')
+
+    # the stored embeddings are a header followed by the raw vector - magic, format version, dtype code, dimension
+    # and a fingerprint of the model which produced the embedding
+    schema_version = 3
+    embedding_header = struct.Struct('<4sBBHI8s')
+    embedding_magic = b'LMEB'
+    embedding_version = 1
+    embedding_dtypes = {'float32': 0, 'float16': 1, 'uint8': 2}
+    model_hash = bytes(8)   # the fingerprint of the running model, set once the model is loaded
+
     def __init__(self):
         if not os.path.exists(Database.parent_dir):
             os.mkdir(Database.parent_dir)
@@ -28,11 +53,24 @@ class Database:
         if os.path.exists(Database.locked_path):
             self.enc_track.decrypt_file()
 
-        self.connection = sqlite3.connect(Database.org_path)    # connect to the database
+        # connect to the database - it may be opened in a background thread and used in the UI thread
+        self.connection = sqlite3.connect(Database.org_path, check_same_thread=False)
         self.cursor = self.connection.cursor()
+        self.blobs = BlobStore(Database.blobs_path)
 
         self.__init_tables()    # create the tables
 
+        if Database.sidecar_dtype is None:
+            self.gallery = Gallery(config.EMBEDDING_SIZE, Database.embedding_dtype)
+            self.__load_gallery()   # cache the users embeddings for login
+        else:
+            if os.path.exists(Database.sidecar_locked_path):
+                os.remove(Database.sidecar_locked_path)     # rebuilt from the DB below
+            self.gallery = MemmapGallery(Database.sidecar_matrix_path, Database.sidecar_index_path,
+                                         config.EMBEDDING_SIZE, Database.sidecar_dtype)
+            if self.gallery.generation != self.__generation():   # the store is kept only if left by an interrupted run
+                self.__load_gallery()
+
     def __del__(self):
         """
         Encrypt the DB before termination
@@ -40,84 +78,297 @@ class Database:
         self.lock_all_files()
         self.connection.close()
         self.enc_track.encrypt_file()
+        if isinstance(self.gallery, MemmapGallery):
+            self.gallery.delete()   # no plaintext embeddings are left at rest
+        else:
+            self.gallery.close()
 
     def __init_tables(self):
         """
-        Initiate the database's tables if needed
+        Initiate the database's tables if needed and migrate the tables of older versions
         """
+        self.cursor.execute("PRAGMA user_version")
+        version = self.cursor.fetchone()[0]
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+        if version < 1 and self.cursor.fetchone() is not None:
+            self.__migrate_embeddings()
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'files'")
+        if version < 2 and self.cursor.fetchone() is not None:
+            self.__migrate_files()
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'files'")
+        if version < 3 and self.cursor.fetchone() is not None:
+            self.__migrate_backups()
+
         self.cursor.execute(
             "CREATE TABLE IF NOT EXISTS users("
             "uid INTEGER PRIMARY KEY,"
-            "user_embedding TEXT,"
-            "user_image TEXT)"
+            "user_embedding BLOB,"
+            "user_image BLOB)"
         )
         self.cursor.execute(
             "CREATE TABLE IF NOT EXISTS files("
-            "file_path TEXT PRIMARY KEY,"
+            "path_key TEXT PRIMARY KEY,"
+            "file_path TEXT,"
             "suffix TEXT,"
             "uid INTEGER,"
-            "file TEXT,"
+            "blob_hash TEXT,"
             "file_state INTEGER)"
         )
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS files_uid ON files(uid)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS files_state ON files(file_state)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS files_blob ON files(blob_hash)")
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS templates("
+            "tid INTEGER PRIMARY KEY,"
+            "uid INTEGER,"
+            "embedding BLOB)"
+        )
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS templates_uid ON templates(uid)")
+        # counts the changes of the stored embeddings, the sidecar store is in sync when it holds the same count
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS meta(name TEXT PRIMARY KEY, value INTEGER)")
+        self.cursor.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('generation', 0)")
+        self.cursor.execute(f"PRAGMA user_version = {Database.schema_version}")
+        self.connection.commit()
+
+    def __migrate_embeddings(self):
+        """
+        One-shot migration of the headerless embeddings to BLOB columns with the versioned header.
+        Every embedding keeps its stored dtype and values, so the file keys derived from it do not change.
+        The producing model is unknown, so the migrated embeddings get an empty model fingerprint
+        """
+        Logger(msg.Info.db_migration, Logger.info).log()
+        self.cursor.execute("SELECT uid, user_embedding, user_image FROM users")
+        users = [(uid, Database.__encode_legacy(embedding_b), image) for uid, embedding_b, image in
+                 self.cursor.fetchall()]
+        templates = []
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'templates'")
+        if self.cursor.fetchone() is not None:  # databases older than the templates have none to migrate
+            self.cursor.execute("SELECT tid, uid, embedding FROM templates")
+            templates = [(tid, uid, Database.__encode_legacy(embedding_b)) for tid, uid, embedding_b in
+                         self.cursor.fetchall()]
+
+        self.cursor.execute("DROP TABLE IF EXISTS templates")
+        self.cursor.execute("DROP TABLE users")
+        self.cursor.execute("CREATE TABLE users(uid INTEGER PRIMARY KEY, user_embedding BLOB, user_image BLOB)")
+        self.cursor.execute("CREATE TABLE templates(tid INTEGER PRIMARY KEY, uid INTEGER, embedding BLOB)")
+        self.cursor.executemany("INSERT INTO users (uid, user_embedding, user_image) VALUES (?,?,?)", users)
+        self.cursor.executemany("INSERT INTO templates (tid, uid, embedding) VALUES (?,?,?)", templates)
+        self.connection.commit()
+
+    def __migrate_files(self):
+        """
+        One-shot migration of the files table to be keyed by the canonical path key.
+        Paths differing only by case or separators are the same path on Windows - the first of them gets the path key
+        and every other row is kept under the key followed by its suffix ('|' is not valid in Windows paths), so no
+        file and no backup is lost
+        """
+        self.cursor.execute("ALTER TABLE files RENAME TO files_legacy")
+        self.cursor.execute("CREATE TABLE files(path_key TEXT PRIMARY KEY, file_path TEXT, suffix TEXT, uid INTEGER, "
+                            "file TEXT, file_state INTEGER)")
+        self.cursor.execute("SELECT file_path, suffix FROM files_legacy ORDER BY rowid")
+        for path, suffix in self.cursor.fetchall():
+            key = candidate = Database.path_key(path)
+            n = 0
+            while self.cursor.execute("SELECT 1 FROM files WHERE path_key = ?", (candidate,)).fetchone() is not None:
+                n += 1
+                candidate = f'{key}|{suffix}' if n == 1 else f'{key}|{suffix}|{n - 1}'
+            if candidate != key:
+                Logger(msg.Errors.path_conflict.format(path, suffix, candidate), Logger.warning).log()
+            self.cursor.execute("INSERT INTO files (path_key, file_path, suffix, uid, file, file_state) "
+                                "SELECT ?, file_path, suffix, uid, file, file_state FROM files_legacy "
+                                "WHERE file_path = ?", (candidate, path))
+        self.cursor.execute("DROP TABLE files_legacy")
         self.connection.commit()
 
+    def __migrate_backups(self):
+        """
+        One-shot migration of the backups out of the files table into the blob store, one file at a time.
+        The stored bytes are moved as they are. An interrupted migration continues from the files not moved yet
+        """
+        Logger(msg.Info.db_migration, Logger.info).log()
+        self.cursor.execute("PRAGMA table_info(files)")
+        columns = [row[1] for row in self.cursor.fetchall()]
+        if 'blob_hash' not in columns:
+            self.cursor.execute("ALTER TABLE files ADD COLUMN blob_hash TEXT")
+        if 'file' in columns:
+            self.cursor.execute("SELECT path_key FROM files WHERE blob_hash IS NULL")
+            for key, in self.cursor.fetchall():
+                self.cursor.execute("SELECT file FROM files WHERE path_key = ?", (key,))
+                digest = self.blobs.write([bytes(self.cursor.fetchone()[0])])
+                self.cursor.execute("UPDATE files SET blob_hash = ? WHERE path_key = ?", (digest, key))
+                self.connection.commit()
+            self.cursor.execute("ALTER TABLE files DROP COLUMN file")
+        self.connection.commit()
+        self.cursor.execute("VACUUM")   # give the space of the moved backups back to the file system
+
+    @staticmethod
+    def __encode_legacy(embedding_b) -> bytes:
+        """
+        Add the header to a headerless embedding, whose dtype is recognized by its size
+        :param embedding_b: the headerless embedding
+        :return: the embedding with the header, same payload
+        """
+        match len(embedding_b):
+            case size if size == config.EMBEDDING_SIZE * 2:
+                dtype = 'float16'
+            case size if size == config.EMBEDDING_SIZE + 4:
+                dtype = 'uint8'
+            case _:
+                dtype = 'float32'
+        header = Database.embedding_header.pack(Database.embedding_magic, Database.embedding_version,
+                                                Database.embedding_dtypes[dtype], 0, config.EMBEDDING_SIZE, bytes(8))
+        return header + bytes(embedding_b)
+
+    def __load_gallery(self):
+        """
+        Load all the users embeddings (the primary and the additional templates) from the DB into the in-memory gallery
+        """
+        generation = self.__generation()
+        self.cursor.execute("SELECT uid, user_embedding FROM users UNION ALL SELECT uid, embedding FROM templates")
+        data = self.cursor.fetchall()
+        uids = np.fromiter((row[0] for row in data), dtype=np.int64, count=len(data))
+        matrix = np.empty((len(data), config.EMBEDDING_SIZE), dtype=np.float32)
+        for i, row in enumerate(data):
+            matrix[i] = Database.byte_to_embedding(row[1])
+        self.gallery.load(uids, matrix)
+        self.__gallery_synced(generation)
+
+    def __generation(self) -> int:
+        """
+        :return: the number of changes of the stored embeddings
+        """
+        self.cursor.execute("SELECT value FROM meta WHERE name = 'generation'")
+        return self.cursor.fetchone()[0]
+
+    def __next_generation(self) -> int:
+        """
+        Count a change of the stored embeddings, as part of the open transaction
+        :return: the new generation
+        """
+        self.cursor.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+        return self.__generation()
+
+    def __gallery_synced(self, generation: int):
+        """
+        Mark the sidecar store as holding the embeddings of a generation, after the gallery was updated
+        :param generation: the DB's embeddings generation
+        """
+        if isinstance(self.gallery, MemmapGallery):
+            self.gallery.generation = generation
+
     @staticmethod
     def _compress_data(data):
         """
         Compress data using the BZ2 compression algorithm
         :param data: data to compress
-        :return: the compressed data
+        :return: a generator of the compressed data chunks
         """
         compressor = bz.BZ2Compressor()
-        compressed_data = compressor.compress(data) + compressor.flush()
-        return compressed_data
+        data = memoryview(data)
+        for start in range(0, len(data), BlobStore.chunk_size):
+            if chunk := compressor.compress(data[start: start + BlobStore.chunk_size]):
+                yield chunk
+        yield compressor.flush()
 
     @staticmethod
-    def _decompress_data(data):
+    def _decompress_data(chunks):
         """
         Decompress data using the BZ2 compression algorithm
-        :param data: compress BZ2 data
-        :return: the decompressed data
+        :param chunks: an iterable of the compressed BZ2 data chunks
+        :return: a generator of the decompressed data chunks
+        """
+        decompressor = bz.BZ2Decompressor()
+        for chunk in chunks:
+            if decompressed := decompressor.decompress(chunk):
+                yield decompressed
+
+    @staticmethod
+    def model_fingerprint(weights) -> bytes:
         """
-        decompressed_data = bz.decompress(data).decode()
-        return decompressed_data
+        :param weights: the SNN head weights of a model
+        :return: the 8 bytes fingerprint of the model stored with its embeddings
+        """
+        return hashlib.sha256(np.asarray(weights, dtype=np.float32).tobytes()).digest()[:8]
 
     @staticmethod
     def _embedding_to_byte(embedding):
         """
-        Transform a float list embedding to bytes type
+        Transform an embedding to the stored format - the header followed by the vector in the configured dtype
         :param embedding: the embedding vector
         :return: the bytes type embedding
         """
-        embedding_b = bytearray(struct.pack(f'{Net.embedding_size}f', *embedding))
-        return embedding_b
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        match Database.embedding_dtype:
+            case 'float16':
+                payload = embedding.astype(np.float16).tobytes()
+            case 'uint8':
+                quantized, scales = Gallery.quantize(embedding)
+                payload = scales.tobytes() + quantized.tobytes()
+            case _:
+                payload = embedding.tobytes()
+        header = Database.embedding_header.pack(Database.embedding_magic, Database.embedding_version,
+                                                Database.embedding_dtypes[Database.embedding_dtype], 0,
+                                                len(embedding), Database.model_hash)
+        return header + payload
 
     @staticmethod
-    def byte_to_embedding(embedding_b):
+    def byte_to_embedding(embedding_b) -> np.ndarray:
         """
-        Transform bytes type embedding to a float list
+        Transform a stored embedding to a float32 vector, the dtype is read from the header
         :param embedding_b: the bytes type embedding
-        :return: the vectorized embedding
-        """
-        embedding = struct.unpack(f'{Net.embedding_size}f', embedding_b)
-        return embedding
+        :return: the embedding, shape (embedding size, )
+        """
+        magic, version, dtype, _, dim, _ = Database.embedding_header.unpack_from(embedding_b)
+        if magic != Database.embedding_magic or version > Database.embedding_version:
+            Logger(msg.Errors.unknown_embedding_format, Logger.exception).log()
+        offset = Database.embedding_header.size
+        match dtype:
+            case 1:     # float16
+                return np.frombuffer(embedding_b, dtype=np.float16, count=dim, offset=offset).astype(np.float32)
+            case 2:     # uint8 with a float32 scale
+                scales = np.frombuffer(embedding_b, dtype=np.float32, count=1, offset=offset)
+                quantized = np.frombuffer(embedding_b, dtype=np.uint8, count=dim, offset=offset + 4)[None, :]
+                return Gallery.dequantize(quantized, scales)[0]
+        return np.frombuffer(embedding_b, dtype=np.float32, count=dim, offset=offset)
+
+    def count_foreign_embeddings(self) -> int:
+        """
+        Count the stored embeddings produced by another model than the running one (migrated embeddings of an
+        unknown model are not counted).
+        It runs in an Init worker while the UI thread may use the DB, so it reads with a cursor of its own
+        (the connection itself is serialized by SQLite)
+        :return: the number of embeddings
+        """
+        start, size = Database.embedding_header.size - 7, 8     # the fingerprint is the header's tail (1-based)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"SELECT substr(user_embedding, {start}, {size}) FROM users "
+                           f"UNION ALL SELECT substr(embedding, {start}, {size}) FROM templates")
+            return sum(fingerprint not in (Database.model_hash, bytes(8)) for fingerprint, in cursor.fetchall())
+        finally:
+            cursor.close()
 
-    def _recover(self, path, comp_file, key, locked_path):
+    def _recover(self, path, blob_hash, key, locked_path):
         """
-        Recover a file from the database
+        Recover a file from its backup
         :param path: path to the file as it was originally add to the system
-        :param comp_file: the compressed file as it is the database
+        :param blob_hash: the hash of the file's backup in the blob store
         :param key: key to the fernet encryption
         :param locked_path: the path to the file with the locked suffix
         """
-        with open(path, 'wb') as fd:
-            enc_file = Database._decompress_data(comp_file).encode('utf-8')
-            recovered_data = Encryption.decrypt_data(enc_file, key)
+        with open(path, 'w+b') as fd:
+            # stream the encrypted contents into the file, the Fernet token is then decrypted as a whole
+            for chunk in Database._decompress_data(self.blobs.read(blob_hash)):
+                fd.write(chunk)
+            fd.seek(0)
+            recovered_data = Encryption.decrypt_data(fd.read(), key)
+            fd.seek(0)
+            fd.truncate()
             fd.write(recovered_data)
         if os.path.exists(locked_path):
             os.remove(locked_path)
-        self.cursor.execute("UPDATE files SET file_state = ? WHERE file_path = ?",
-                            (Database.file_state_open, Database.raw_path(path)))
+        self.cursor.execute("UPDATE files SET file_state = ? WHERE path_key = ?",
+                            (Database.file_state_open, Database.path_key(Database.raw_path(path))))
         self.connection.commit()
         Logger(msg.Info.file_recovered + f' {path}', Logger.info).log()
 
@@ -137,25 +388,33 @@ class Database:
         self.cursor.execute("SELECT uid FROM users")
         return self.cursor.fetchall()
 
-    def fetch_user_data(self, uid=None):
+    def fetch_user_data(self, uid=None, file_state=None, keys: bool = False):
         """
         Retrieve the user's data
-        :param uid: the current user ID
+        :param uid: the current user ID, all the system files if None
+        :param file_state: only the files in this state if specified
+        :param keys: add the files path keys to the data
         :return: the user's data as a dictionary:
-            {'file_path': [...], 'suffix': [...], 'user_id': [...], 'file': [...], 'file_state': [...]}
-        """
-        if uid is None:
-            self.cursor.execute("SELECT file_path, suffix, uid, file, file_state FROM files")
-        else:
-            self.cursor.execute("SELECT file_path, suffix, uid, file, file_state FROM files WHERE uid = ?", (uid,))
+            {'file_path': [...], 'suffix': [...], 'user_id': [...], 'file_state': [...]} (and 'path_key': [...])
+        """
+        conditions, params = [], []
+        if uid is not None:
+            conditions.append('uid = ?')
+            params.append(uid)
+        if file_state is not None:
+            conditions.append('file_state = ?')
+            params.append(file_state)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        self.cursor.execute("SELECT file_path, suffix, uid, file_state, path_key FROM files" + where, params)
         data = self.cursor.fetchall()
-        data_dict = {'file_path': [], 'suffix': [], 'user_id': [], 'file': [], 'file_state': []}
+        data_dict = {'file_path': [], 'suffix': [], 'user_id': [], 'file_state': []}
+        if keys:
+            data_dict['path_key'] = [row[4] for row in data]
         for row in data:
             data_dict['file_path'].append(row[0])
             data_dict['suffix'].append(row[1])
             data_dict['user_id'].append(row[2])
-            data_dict['file'].append(row[3])
-            data_dict['file_state'].append(row[4])
+            data_dict['file_state'].append(row[3])
         return data_dict
 
     def create_new_user(self, user):
@@ -175,9 +434,39 @@ class Database:
         image = user.img_data.image.copy()
         self.cursor.execute("INSERT INTO users (uid, user_embedding, user_image) VALUES (?,?,?)",
                             (max_id + 1, embedding_b, image.tobytes()))
+        generation = self.__next_generation()
         self.connection.commit()
+        self.gallery.add(max_id + 1, user.embedding)
+        self.__gallery_synced(generation)
         return max_id + 1
 
+    def add_template(self, uid: int, embedding):
+        """
+        Add another face template to an existing user. The file keys are still derived from the primary embedding
+        :param uid: the user ID
+        :param embedding: the embedding vector of the template
+        """
+        self.cursor.execute("INSERT INTO templates (uid, embedding) VALUES (?, ?)",
+                            (uid, Database._embedding_to_byte(embedding)))
+        generation = self.__next_generation()
+        self.connection.commit()
+        self.gallery.add(uid, embedding)
+        self.__gallery_synced(generation)
+
+    def fetch_user_embeddings(self, uid: int) -> np.ndarray:
+        """
+        Fetch the embeddings of a single user (the primary one and the additional templates) by the user ID
+        :param uid: the user ID
+        :return: the embeddings as a float32 matrix, shape (m, embedding size)
+        """
+        self.cursor.execute("SELECT user_embedding FROM users WHERE uid = ? "
+                            "UNION ALL SELECT embedding FROM templates WHERE uid = ?", (uid, uid))
+        data = self.cursor.fetchall()
+        embeddings = np.empty((len(data), config.EMBEDDING_SIZE), dtype=np.float32)
+        for i, row in enumerate(data):
+            embeddings[i] = Database.byte_to_embedding(row[0])
+        return embeddings
+
     def get_user_embedding_as_key(self, uid: int):
         """
         Retrieve the user face embedding from the DB and generate the key from it
@@ -187,7 +476,7 @@ class Database:
         self.cursor.execute("SELECT user_embedding FROM users WHERE uid = ?", (uid,))
         embedding_b = self.cursor.fetchall()[0][0]
         embedding = Database.byte_to_embedding(embedding_b)
-        key = Encryption.key_from_embedding(list(embedding))
+        key = Encryption.key_from_embedding(embedding.tolist())     # python floats, as the key was always derived
         return key
 
     def __validate_action_on_file(self, path: str, user):
@@ -195,30 +484,54 @@ class Database:
         Check if the file is accessible and the user could change it
         :param path: path to the file without suffix
         :param user: a User object
-        :return: True if file is accessible else False
+        :return: True if file is accessible else False, and the file's data (without the backup)
         """
-        self.cursor.execute("SELECT file_path, uid, suffix, file, file_state FROM files")
-        res = self.cursor.fetchall()
-        suffix = None
-        file_state = None
-        comp_file = None
-
         path = Database.formalize_path(path)
-        found = False
-        for row in res:
-            if path == Database.formalize_path(row[0]):
-                if row[1] != user.uid:
-                    Logger(msg.Errors.access_denied + f' to file {path}', Logger.inform).log()
-                    return False, None
-                found = True
-                suffix = row[2]
-                comp_file = row[3]
-                file_state = row[4]
-                break
-        if not found:
+        self.cursor.execute("SELECT uid, suffix, file_state, blob_hash FROM files WHERE path_key = ?",
+                            (Database.path_key(path),))
+        row = self.cursor.fetchone()
+        if row is None:
             Logger(msg.Errors.failed_removal, Logger.inform).log()
             return False, None
-        return True, {'file_path': path, 'uid': user.uid, 'suffix': suffix, 'file': comp_file, 'file_state': file_state}
+        if row[0] != user.uid:
+            Logger(msg.Errors.access_denied + f' to file {path}', Logger.inform).log()
+            return False, None
+        return True, {'file_path': path, 'uid': user.uid, 'suffix': row[1], 'file_state': row[2], 'blob_hash': row[3]}
+
+    def __update_backup(self, key: str, enc_data: bytes):
+        """
+        Replace the backup of a locked file by its latest version and release the previous one
+        :param key: the path key of the file
+        :param enc_data: the encrypted file contents
+        """
+        self.cursor.execute("SELECT blob_hash FROM files WHERE path_key = ?", (key,))
+        previous = self.cursor.fetchone()[0]
+        blob_hash = self.blobs.write(Database._compress_data(enc_data))
+        self.cursor.execute("UPDATE files SET file_state = ?, blob_hash = ? WHERE path_key = ?",
+                            (Database.file_state_locked, blob_hash, key))
+        self.connection.commit()
+        self.__release_blobs([previous])
+
+    def __release_blobs(self, blob_hashes):
+        """
+        Remove the backups no file references anymore
+        :param blob_hashes: the hashes of the backups
+        """
+        for blob_hash in set(blob_hashes):
+            self.cursor.execute("SELECT 1 FROM files WHERE blob_hash = ? LIMIT 1", (blob_hash,))
+            if self.cursor.fetchone() is None:
+                self.blobs.remove(blob_hash)
+
+    def collect_garbage(self) -> int:
+        """
+        Remove the backups in the blob store which no file references. It walks the whole store, so it runs on demand
+        and after a user is deleted rather than on every start
+        :return: the number of removed blobs
+        """
+        self.cursor.execute("SELECT blob_hash FROM files")
+        removed = self.blobs.collect({row[0] for row in self.cursor.fetchall()})
+        Logger(msg.Info.blobs_collected.format(removed), Logger.info, condition=removed > 0).log()
+        return removed
 
     def add_file(self, path: str, user) -> bool:
         """
@@ -228,13 +541,12 @@ class Database:
         :return: True if file was successfully added to the DB
         """
         # check if the file is already in the database
-        self.cursor.execute("SELECT file_path, uid FROM files")
-        res = self.cursor.fetchall()
         path = Database.formalize_path(path)
-        for row in res:
-            if Database.raw_path(path) == row[0]:
-                Logger(msg.Errors.failed_insertion + f' - owner ID: {row[1]}', Logger.inform).log()
-                return False
+        self.cursor.execute("SELECT uid FROM files WHERE path_key = ?", (Database.path_key(Database.raw_path(path)),))
+        row = self.cursor.fetchone()
+        if row is not None:
+            Logger(msg.Errors.failed_insertion + f' - owner ID: {row[0]}', Logger.inform).log()
+            return False
 
         if '.' in path:
             suffix = path.split('.')[-1]
@@ -255,10 +567,11 @@ class Database:
             return False
 
         enc_data = Encryption.encrypt_data(data, key)
-        comp_data = Database._compress_data(enc_data)
+        blob_hash = self.blobs.write(Database._compress_data(enc_data))
         self.cursor.execute(
-            "INSERT INTO files (file_path, suffix, uid, file, file_state) VALUES (?, ?, ?, ?, ?)",
-            (Database.raw_path(path), suffix, user.uid, comp_data, Database.file_state_open))
+            "INSERT INTO files (path_key, file_path, suffix, uid, blob_hash, file_state) VALUES (?, ?, ?, ?, ?, ?)",
+            (Database.path_key(Database.raw_path(path)), Database.raw_path(path), suffix, user.uid, blob_hash,
+             Database.file_state_open))
         self.connection.commit()
         Logger(msg.Info.file_added + f' {path}', Logger.info).log()
         return True
@@ -279,8 +592,9 @@ class Database:
         self.decrypt_user_file(path, user, db_data)
 
         # delete the file from the database
-        self.cursor.execute("DELETE FROM files WHERE file_path = ?", (Database.raw_path(path),))
+        self.cursor.execute("DELETE FROM files WHERE path_key = ?", (Database.path_key(Database.raw_path(path)),))
         self.connection.commit()
+        self.__release_blobs([db_data['blob_hash']])
         Logger(msg.Info.file_removed + f' {path}', Logger.info).log()
         return True
 
@@ -310,15 +624,12 @@ class Database:
 
         try:
             enc_data = file_enc.encrypt_file()
-            comp_data = Database._compress_data(enc_data)
 
             # change the file state in the database and update to the latest version
-            self.cursor.execute("UPDATE files SET file_state = ?, file = ? WHERE file_path = ?",
-                                (Database.file_state_locked, comp_data, Database.raw_path(path)))
-            self.connection.commit()
+            self.__update_backup(Database.path_key(Database.raw_path(path)), enc_data)
             return True
         except:
-            self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['file'], key, locked_path)
+            self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['blob_hash'], key, locked_path)
             return False
 
     def unlock_file(self, path: str, user) -> bool:
@@ -342,8 +653,8 @@ class Database:
         self.decrypt_user_file(path, user, db_data)
 
         # change the file state in the database
-        self.cursor.execute("UPDATE files SET file_state = ? WHERE file_path = ?",
-                            (Database.file_state_open, Database.raw_path(path)))
+        self.cursor.execute("UPDATE files SET file_state = ? WHERE path_key = ?",
+                            (Database.file_state_open, Database.path_key(Database.raw_path(path))))
         self.connection.commit()
         return True
 
@@ -365,14 +676,14 @@ class Database:
                 locked_path = file_enc.locked_path
                 file_enc.decrypt_file()
         except:
-            self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['file'], key, locked_path)
+            self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['blob_hash'], key, locked_path)
 
     def lock_all_files(self, uid: int = None):
         """
         Lock all files owned by the specified ID. If no ID is specified, lock all the system files
         :param uid: user ID
         """
-        data_dict = self.fetch_user_data(uid)
+        data_dict = self.fetch_user_data(uid, Database.file_state_open, keys=True)
         if len(data_dict['file_path']) == 0:    # prevent from running tqdm
             return
 
@@ -392,12 +703,9 @@ class Database:
             key = self.get_user_embedding_as_key(data_dict['user_id'][i])
             file_enc = Encryption(f'{path}.{data_dict["suffix"][i]}', key, data_dict['suffix'][i])
             enc_data = file_enc.encrypt_file(log=False)
-            comp_data = Database._compress_data(enc_data)
 
             # change the file state in the database and update to latest changes
-            self.cursor.execute("UPDATE files SET file_state = ?, file = ? WHERE file_path = ?",
-                                (Database.file_state_locked, comp_data, path))
-            self.connection.commit()
+            self.__update_backup(data_dict['path_key'][i], enc_data)
         print()     # this is a bug fix of tqdm covering the input line
 
     def unlock_all_files(self, uid: int = None):
@@ -405,7 +713,7 @@ class Database:
         Unlock all files owned by the specified ID. If no ID is specified, unlock all the system files
         :param uid: user ID
         """
-        data_dict = self.fetch_user_data(uid)
+        data_dict = self.fetch_user_data(uid, Database.file_state_locked, keys=True)
         if len(data_dict['file_path']) == 0:    # prevent from running tqdm
             return
 
@@ -427,8 +735,8 @@ class Database:
             file_enc.decrypt_file(log=False)
 
             # change the file state in the database
-            self.cursor.execute("UPDATE files SET file_state = ? WHERE file_path = ?",
-                                (Database.file_state_open, path))
+            self.cursor.execute("UPDATE files SET file_state = ? WHERE path_key = ?",
+                                (Database.file_state_open, data_dict['path_key'][i]))
             self.connection.commit()
         print()  # this is a bug fix of tqdm covering the input line
 
@@ -442,9 +750,17 @@ class Database:
         Logger(msg.Requests.delete_user, level=Logger.message).log()
         if sure:
             self.unlock_all_files(uid)
+            self.cursor.execute("SELECT blob_hash FROM files WHERE uid = ?", (uid,))
+            blob_hashes = [row[0] for row in self.cursor.fetchall()]
             self.cursor.execute("DELETE FROM files WHERE uid = ?", (uid,))
             self.cursor.execute("DELETE FROM users WHERE uid = ?", (uid,))
+            self.cursor.execute("DELETE FROM templates WHERE uid = ?", (uid,))
+            generation = self.__next_generation()
             self.connection.commit()
+            self.__release_blobs(blob_hashes)
+            self.collect_garbage()  # also drop the backups left unreferenced by an interrupted operation
+            self.gallery.remove(uid)
+            self.__gallery_synced(generation)
             Logger(msg.Info.user_deleted + f' - ID: {uid}', Logger.warning).log()
             return True
 
@@ -455,9 +771,17 @@ class Database:
             ans = ans.lower()
             if ans == KeyMap.yes:
                 self.unlock_all_files(uid)
+                self.cursor.execute("SELECT blob_hash FROM files WHERE uid = ?", (uid,))
+                blob_hashes = [row[0] for row in self.cursor.fetchall()]
                 self.cursor.execute("DELETE FROM files WHERE uid = ?", (uid,))
                 self.cursor.execute("DELETE FROM users WHERE uid = ?", (uid,))
+                self.cursor.execute("DELETE FROM templates WHERE uid = ?", (uid,))
+                generation = self.__next_generation()
                 self.connection.commit()
+                self.__release_blobs(blob_hashes)
+                self.collect_garbage()  # also drop the backups left unreferenced by an interrupted operation
+                self.gallery.remove(uid)
+                self.__gallery_synced(generation)
                 Logger(msg.Info.user_deleted + f' - ID: {uid}', Logger.warning).log()
                 return True
             elif ans == KeyMap.no:
@@ -477,7 +801,8 @@ class Database:
 
         key = self.get_user_embedding_as_key(user.uid)
         file_enc = Encryption(f'{Database.raw_path(path)}.{db_data["suffix"]}', key, db_data['suffix'])
-        self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['file'], key, file_enc.locked_path)
+        self._recover(f'{Database.raw_path(path)}.{db_data["suffix"]}', db_data['blob_hash'], key,
+                      file_enc.locked_path)
         return True
 
     def get_user_image(self, uid, dims, convert_rgb=False):
@@ -496,3 +821,11 @@ class Database:
     @staticmethod
     def raw_path(path):
         return '.'.join(path.split('.')[:-1])
+
+    @staticmethod
+    def path_key(path):
+        """
+        :param path: path to a file without suffix
+        :return: the canonical key of the path in the DB - Windows paths are case insensitive and take both separators
+        """
+        return ntpath.normcase(ntpath.normpath(path))
@@ -1,12 +1,11 @@
 import os
 import numpy as np
 from cryptography.fernet import Fernet
-import winreg
 import base64
 
 from utils.logger import Logger
 from utils.messages import Messages as msg
-from model.SNN import Net
+import model.config as config
 
 
 class Encryption:
@@ -70,6 +69,7 @@ class Encryption:
         Retrieve or generate the database encryption key and save it in the registry
         :return: The database encryption key
         """
+        import winreg   # Windows only, imported here so the module loads on other platforms (e.g. for the tests)
         enc_key = None
         try:
             # try getting the key
@@ -102,10 +102,10 @@ class Encryption:
         :param embedding: A float vector representing an image
         :return: The key generated from the vector
         """
-        if len(embedding) < Net.embedding_size:
+        if len(embedding) < config.EMBEDDING_SIZE:
             Logger(msg.Errors.BUG, Logger.exception).log()
 
-        step = int(Net.embedding_size / 128)
+        step = int(config.EMBEDDING_SIZE / 128)
         for i in range(128):
             embedding[i] = np.sum(np.array(embedding[i * step: i * step + step]))
         embedding = embedding[: 128]
@@ -0,0 +1,400 @@
+import os
+import numpy as np
+
+from utils.logger import Logger
+from utils.messages import Messages as msg
+
+
+class Gallery:
+    """
+    In-memory cache of the enrolled face embeddings stored as one contiguous matrix with a matching user ID array.
+    A user may own several rows of the gallery.
+    The matrix is float32, float16 or uint8. The SNN embeddings are sigmoid outputs in [0, 1], so uint8 rows are
+    quantized with a per-row scale.
+    """
+    initial_capacity = 64
+    block_rows = 256    # rows dequantized at once while scoring a compressed gallery
+
+    def __init__(self, dim: int, dtype=np.float32):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._uids = np.empty(Gallery.initial_capacity, dtype=np.int64)
+        self._matrix = np.empty((Gallery.initial_capacity, dim), dtype=self.dtype)
+        self._scales = np.empty(Gallery.initial_capacity, dtype=np.float32) if self.quantized else None
+        self._size = 0
+        self.observers = []     # objects notified on every change of the gallery (on_load, on_add, on_remove)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def uids(self) -> np.ndarray:
+        """
+        :return: the user IDs of the gallery rows, shape (n, )
+        """
+        return self._uids[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        :return: the gallery embeddings as stored, shape (n, dim)
+        """
+        return self._matrix[:self._size]
+
+    @property
+    def scales(self) -> np.ndarray:
+        """
+        :return: the per-row quantization scales of a uint8 gallery, shape (n, )
+        """
+        return self._scales[:self._size]
+
+    @property
+    def quantized(self) -> bool:
+        return self.dtype == np.uint8
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the memory used by the stored embeddings
+        """
+        return self.matrix.nbytes + (self.scales.nbytes if self.quantized else 0)
+
+    @staticmethod
+    def quantize(matrix: np.ndarray):
+        """
+        Quantize embeddings in [0, 1] to uint8 with a per-row scale
+        :param matrix: the embeddings, shape (n, dim)
+        :return: the quantized matrix and the scales, shape (n, )
+        """
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+        scales = matrix.max(axis=1) / 255
+        scales[scales == 0] = 1
+        quantized = np.rint(matrix / scales[:, None]).astype(np.uint8)
+        return quantized, scales.astype(np.float32)
+
+    @staticmethod
+    def dequantize(quantized: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        """
+        Restore float32 embeddings from a uint8 matrix
+        :param quantized: the quantized matrix, shape (n, dim)
+        :param scales: the per-row scales, shape (n, )
+        :return: the float32 embeddings, shape (n, dim)
+        """
+        return quantized.astype(np.float32) * scales[:, None]
+
+    def blocks(self, rows: np.ndarray = None):
+        """
+        Iterate over the gallery embeddings as float32 blocks, for scoring directly on the stored matrix.
+        A float32 gallery is yielded as a single block without copying
+        :param rows: the row indices to iterate over, all rows if not specified
+        :return: generator of float32 blocks of at most block_rows rows
+        """
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.dtype == np.float32:
+            yield matrix
+            return
+        scales = None
+        if self.quantized:
+            scales = self.scales if rows is None else self.scales[rows]
+        for start in range(0, len(matrix), Gallery.block_rows):
+            block = matrix[start: start + Gallery.block_rows]
+            if self.quantized:
+                yield Gallery.dequantize(block, scales[start: start + Gallery.block_rows])
+            else:
+                yield block.astype(np.float32)
+
+    def take(self, rows: np.ndarray, dims: np.ndarray) -> np.ndarray:
+        """
+        Gather a sub-matrix of the gallery without touching the other dimensions of the rows
+        :param rows: the row indices
+        :param dims: the dimension indices
+        :return: the float32 sub-matrix, shape (len(rows), len(dims))
+        """
+        block = self.matrix[np.ix_(rows, dims)]
+        if self.quantized:
+            return Gallery.dequantize(block, self.scales[rows])
+        return block.astype(np.float32, copy=False)
+
+    def embeddings(self, rows: np.ndarray = None) -> np.ndarray:
+        """
+        :param rows: the row indices to retrieve, all rows if not specified
+        :return: the gallery embeddings as a float32 matrix
+        """
+        blocks = list(self.blocks(rows))
+        if len(blocks) == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+    def _reserve(self, size: int):
+        """
+        Grow the underlying buffers (by doubling) so they can hold at least size rows
+        :param size: the required number of rows
+        """
+        capacity = len(self._uids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+
+        uids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self.dim), dtype=self.dtype)
+        uids[:self._size] = self.uids
+        matrix[:self._size] = self.matrix
+        if self.quantized:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:self._size] = self.scales
+            self._scales = scales
+        self._uids, self._matrix = uids, matrix
+
+    def load(self, uids, matrix):
+        """
+        Replace the gallery content
+        :param uids: the user IDs of the rows
+        :param matrix: the embeddings matrix, shape (n, dim)
+        """
+        self._size = 0
+        self._reserve(len(uids))
+        self._uids[:len(uids)] = uids
+        if self.quantized:
+            self._matrix[:len(uids)], self._scales[:len(uids)] = Gallery.quantize(matrix)
+        else:
+            self._matrix[:len(uids)] = matrix
+        self._size = len(uids)
+        for observer in self.observers:
+            observer.on_load(self.uids, self.matrix)
+
+    def add(self, uid: int, embedding):
+        """
+        Append an embedding of a user to the gallery
+        :param uid: the user ID
+        :param embedding: the embedding vector
+        """
+        self._reserve(self._size + 1)
+        self._uids[self._size] = uid
+        if self.quantized:
+            quantized, scales = Gallery.quantize(embedding)
+            self._matrix[self._size], self._scales[self._size] = quantized[0], scales[0]
+        else:
+            self._matrix[self._size] = embedding
+        self._size += 1
+        for observer in self.observers:
+            observer.on_add(uid, embedding)
+
+    def remove(self, uid: int):
+        """
+        Remove all rows of a user from the gallery, keeping the order of the other rows
+        :param uid: the user ID
+        """
+        keep = self.uids != uid
+        size = int(np.count_nonzero(keep))
+        if size == self._size:
+            return
+        rows = np.flatnonzero(~keep)
+        self._matrix[:size] = self.matrix[keep]
+        if self.quantized:
+            self._scales[:size] = self.scales[keep]
+        self._uids[:size] = self.uids[keep]
+        self._size = size
+        for observer in self.observers:
+            observer.on_remove(uid, rows)
+
+    def get(self, uid: int) -> np.ndarray:
+        """
+        Get the embeddings of a single user
+        :param uid: the user ID
+        :return: the user's embeddings as float32, shape (m, dim)
+        """
+        return self.embeddings(np.flatnonzero(self.uids == uid))
+
+    def close(self):
+        """
+        Release the gallery resources
+        """
+        pass
+
+    def quantization_report(self, weights, bias: float, thresh: float, probes: np.ndarray = None) -> dict:
+        """
+        Compare the identification decisions made on float16 and uint8 copies of the gallery to the float32 decisions
+        :param weights: the SNN head weights, shape (dim, )
+        :param bias: the SNN head bias
+        :param thresh: the login distance threshold
+        :param probes: probe embeddings, shape (m, dim). If not specified, every gallery row is used as a probe
+            against the rest of the gallery (leave-one-out)
+        :return: the report as {dtype: {'changed': changed decisions, 'max_error': max score error, 'bytes': memory}}
+        """
+        weights = np.asarray(weights, dtype=np.float32).reshape(-1)
+        reference = self.embeddings()
+        leave_one_out = probes is None
+        if leave_one_out:
+            probes = reference
+
+        def decide(gallery, probe, exclude):
+            scores = np.concatenate([np.abs(block - probe) @ weights for block in gallery.blocks()]) + bias
+            if exclude is not None:
+                scores[exclude] = np.inf
+            best = int(np.argmin(scores))
+            return (gallery.uids[best] if scores[best] < thresh else None), scores
+
+        float_gallery = Gallery(self.dim, np.float32)
+        float_gallery.load(self.uids, reference)
+        report = {'float32': {'changed': 0, 'max_error': 0., 'bytes': float_gallery.nbytes}}
+        for dtype in (np.float16, np.uint8):
+            gallery = Gallery(self.dim, dtype)
+            gallery.load(self.uids, reference)
+            changed, max_error = 0, 0.
+            for i, probe in enumerate(probes):
+                exclude = i if leave_one_out else None
+                expected, expected_scores = decide(float_gallery, probe, exclude)
+                result, scores = decide(gallery, probe, exclude)
+                changed += int(result != expected)
+                finite = np.isfinite(expected_scores)
+                if finite.any():
+                    max_error = max(max_error, float(np.abs(scores[finite] - expected_scores[finite]).max()))
+            report[np.dtype(dtype).name] = {'changed': changed, 'max_error': max_error, 'bytes': gallery.nbytes}
+        return report
+
+
+class MemmapGallery(Gallery):
+    """
+    Gallery backed by a fixed-stride embedding matrix file and a user ID index file, both opened with numpy.memmap.
+    The gallery is never materialized in the process memory and its pages are shared between processes.
+    The index file layout is [number of rows, item size of the matrix dtype, generation, uid_0, uid_1, ...] - the
+    generation is the DB's embeddings generation the store was last synced to, -1 for a new store.
+    Only float32 and float16 stores are supported.
+    """
+    header_size = 3
+
+    def __init__(self, matrix_path: str, index_path: str, dim: int, dtype=np.float32):
+        self.matrix_path = matrix_path
+        self.index_path = index_path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float16):
+            Logger(msg.Errors.unsupported_sidecar_dtype + f' ({self.dtype})', Logger.exception).log()
+        self._index = None
+        self._uids = None
+        self._matrix = None
+        self._scales = None
+        self.observers = []
+        self._open()
+
+    @property
+    def _size(self) -> int:
+        return int(self._index[0])
+
+    @_size.setter
+    def _size(self, value: int):
+        self._index[0] = value
+
+    @property
+    def generation(self) -> int:
+        return int(self._index[2])
+
+    @generation.setter
+    def generation(self, value: int):
+        self._index[2] = value
+        self._index.flush()
+
+    def _open(self):
+        """
+        Map the store files, creating (or resetting) them if they are missing or were written with another dtype
+        """
+        stride = self.dim * self.dtype.itemsize
+        valid = os.path.exists(self.matrix_path) and os.path.exists(self.index_path)
+        if valid:
+            capacity = os.path.getsize(self.matrix_path) // stride
+            valid = capacity > 0 and os.path.getsize(self.index_path) == (capacity + MemmapGallery.header_size) * 8
+        if valid:
+            header = np.fromfile(self.index_path, dtype=np.int64, count=MemmapGallery.header_size)
+            valid = header[1] == self.dtype.itemsize and header[0] <= capacity
+        if not valid:
+            capacity = Gallery.initial_capacity
+            self._resize_files(capacity, reset=True)
+        self._map(capacity)
+
+    def _resize_files(self, capacity: int, reset: bool = False):
+        """
+        Resize the store files to hold capacity rows
+        :param capacity: the number of rows the files should hold
+        :param reset: clear the files content
+        """
+        mode = 'wb' if reset else 'r+b'
+        with open(self.matrix_path, mode) as fd:
+            fd.truncate(capacity * self.dim * self.dtype.itemsize)
+        with open(self.index_path, mode) as fd:
+            fd.truncate((capacity + MemmapGallery.header_size) * 8)
+            if reset:
+                fd.seek(0)
+                fd.write(np.array([0, self.dtype.itemsize, -1], dtype=np.int64).tobytes())
+
+    def _map(self, capacity: int):
+        """
+        Memory-map the store files
+        :param capacity: the number of rows the files hold
+        """
+        self._index = np.memmap(self.index_path, dtype=np.int64, mode='r+',
+                                shape=(capacity + MemmapGallery.header_size, ))
+        self._uids = self._index[MemmapGallery.header_size:]
+        self._matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r+', shape=(capacity, self.dim))
+
+    def _reserve(self, size: int):
+        capacity = len(self._uids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+
+        self.close()
+        self._resize_files(capacity)
+        self._map(capacity)
+
+    def load(self, uids, matrix):
+        super().load(uids, matrix)
+        self.flush()
+
+    def add(self, uid: int, embedding):
+        super().add(uid, embedding)
+        self.flush()
+
+    def remove(self, uid: int):
+        super().remove(uid)
+        self.flush()
+
+    def flush(self):
+        """
+        Write the mapped pages to the store files
+        """
+        self._matrix.flush()
+        self._index.flush()
+
+    def close(self):
+        """
+        Flush and unmap the store files
+        """
+        if self._index is None:
+            return
+        self.flush()
+        self._index, self._uids, self._matrix = None, None, None
+
+    def delete(self):
+        """
+        Unmap and delete the store files
+        """
+        self.close()
+        for path in (self.matrix_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    # check the enrolled users' login decisions on float16 and uint8 copies of the gallery (leave-one-out)
+    from database import Database
+    from user_login import User
+    from utils.initialize import Init
+
+    engine = Init.build_local_engine()
+    database = Database()
+    for dtype, result in database.gallery.quantization_report(engine.weights, engine.bias, User.dist_thresh).items():
+        print(f'{dtype}: {result["changed"]} changed decisions, max score error {result["max_error"]:.2e}, '
+              f'{result["bytes"]} bytes')
+    del database    # encrypts the DB back
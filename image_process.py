@@ -1,10 +1,10 @@
+import time
 import cv2 as cv
-import numpy as np
 
 from utils.initialize import Init
 from utils.logger import Logger
 from utils.messages import Messages as msg
-from model.dataset import ModelDataset
+from model.preprocess import FacePreprocessor
 from camera_runner import Camera
 
 
@@ -13,14 +13,19 @@ class Image(Init):
     This class is used to compute and retrieve all the data from the image taken by the user
     """
     conf_thresh = 0.9
+    detection_short_side = None     # the short side of the frame copy the faces are detected on, None for full size
+    preprocessor = FacePreprocessor()
 
-    def __init__(self, image):
+    def __init__(self, image, boxes=None):
+        """
+        :param image: the captured frame (BGR)
+        :param boxes: known face bounding boxes in format (x1, y1, x2, y2), the faces are detected if not specified
+        """
         super().__init__()
-        self.image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+        self.image = image
         self.embeddings_dict = {}
 
-        self.create_embeddings()
-        self.image = cv.cvtColor(self.image, cv.COLOR_RGB2BGR)
+        self.create_embeddings(boxes)
         self.x_pos, self.y_pos = None, None
 
     @Logger(msg.Info.faces_located, Logger.info).time_it
@@ -29,7 +34,7 @@ class Image(Init):
         Get the faces bounding boxes in the image
         :return: a list of the bounding boxes
         """
-        boxes, conf = self.mtcnn.detect(self.image)
+        boxes, conf = Image.detect(self.image, Image.detection_short_side)
         boxes = boxes.astype(int)
         new_boxes = []
         for i, box in enumerate(boxes):
@@ -45,17 +50,81 @@ class Image(Init):
             new_boxes.append(box)
         return new_boxes
 
+    @staticmethod
+    def detect(image, short_side: int = None):
+        """
+        Detect the faces of a frame, optionally on a downscaled copy - the cost of the detectors' image pyramids grows
+        with the number of pixels
+        :param image: the frame (BGR)
+        :param short_side: the short side of the downscaled copy, the full frame is used if not specified
+        :return: the bounding boxes in the full frame coordinates, shape (n, 4), and their confidences, shape (n, )
+        """
+        rgb = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+        scale = 1.
+        if short_side is not None and min(image.shape[:2]) > short_side:
+            scale = short_side / min(image.shape[:2])
+            rgb = cv.resize(rgb, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+
+        boxes, conf = Image.detector.detect(rgb)
+        return boxes / scale, conf
+
+    @staticmethod
+    def compare_detection(images, short_side: int):
+        """
+        Compare the detection on downscaled frames to the detection on the full frames
+        :param images: frames (BGR)
+        :param short_side: the short side of the downscaled copies
+        :return: dictionary with the mean latencies in milliseconds, the speedup, the recall of the full size faces
+            (IoU >= 0.5) and the mean IoU of the matched boxes
+        """
+        full_time, scaled_time, found, matched, iou_sum = 0., 0., 0, 0, 0.
+        for image in images:
+            start = time.perf_counter()
+            full, full_conf = Image.detect(image)
+            full_time += time.perf_counter() - start
+            start = time.perf_counter()
+            scaled, scaled_conf = Image.detect(image, short_side)
+            scaled_time += time.perf_counter() - start
+
+            full, scaled = full[full_conf >= Image.conf_thresh], scaled[scaled_conf >= Image.conf_thresh]
+            found += len(full)
+            for box in full:
+                best = max((Image.iou(box, other) for other in scaled), default=0.)
+                if best >= 0.5:
+                    matched += 1
+                    iou_sum += best
+
+        n = max(1, len(images))
+        return {'full_ms': 1000 * full_time / n, 'scaled_ms': 1000 * scaled_time / n,
+                'speedup': full_time / max(scaled_time, 1e-9), 'recall': matched / max(1, found),
+                'mean_iou': iou_sum / max(1, matched)}
+
+    @staticmethod
+    def iou(box1, box2) -> float:
+        """
+        :param box1: bounding box in format (x1, y1, x2, y2)
+        :param box2: bounding box in format (x1, y1, x2, y2)
+        :return: the intersection over union of the boxes
+        """
+        w = max(0., min(box1[2], box2[2]) - max(box1[0], box2[0]))
+        h = max(0., min(box1[3], box2[3]) - max(box1[1], box2[1]))
+        union = (box1[2] - box1[0]) * (box1[3] - box1[1]) + (box2[2] - box2[0]) * (box2[3] - box2[1]) - w * h
+        return w * h / union if union > 0 else 0.
+
     @Logger(msg.Info.embeddings_generated, Logger.info).time_it
-    def create_embeddings(self):
+    def create_embeddings(self, boxes=None):
         """
-        Create embeddings of the detected faces
+        Create embeddings of the detected faces with a single forward pass over all the faces
+        :param boxes: known face bounding boxes, the faces are detected if not specified
         """
-        for box in self.__get_coords():
-            x_aligned = ModelDataset.create_image(self.image, box)
-            x_aligned = cv.cvtColor(x_aligned, cv.COLOR_GRAY2BGR)
-            processed = self.net.preprocess_image(x_aligned)
-            embedding = self.net.forward_once(processed.unsqueeze(0).to(self.device))
-            self.embeddings_dict[tuple(box)] = np.squeeze(embedding.detach().numpy())
+        boxes = self.__get_coords() if boxes is None else boxes
+        if len(boxes) == 0:
+            return
+
+        batch = Image.preprocessor(self.image, boxes)   # (N, 1, 105, 105)
+        embeddings = self.engine.embed(batch)
+        for box, embedding in zip(boxes, embeddings):
+            self.embeddings_dict[tuple(box)] = embedding
 
     def choose_face(self):
         """
@@ -10,7 +10,7 @@ class Net(nn.Module):
     """
     The Siamese Neural Network (SNN) model
     """
-    embedding_size = 4096
+    embedding_size = config.EMBEDDING_SIZE
 
     def __init__(self):
         super(Net, self).__init__()
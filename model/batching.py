@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class BatchScheduler:
+    """
+    Collect the faces of concurrent embedding requests and embed them together. The first waiting request opens a
+    window of window_ms milliseconds (or until max_batch faces are waiting), then all the collected faces run as one
+    batch and the embeddings are handed back through the requests' futures
+    """
+    window_ms = 5.
+    max_batch = 32
+
+    def __init__(self, engine):
+        """
+        :param engine: an InferenceEngine (or OnnxEngine) object
+        """
+        self.engine = engine
+        self._queue = queue.Queue()
+        self._batches = 0
+        self._faces = 0
+        self._requests = 0
+        self._delay = 0.
+        self._max_delay = 0.
+        self._metrics_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._worker.start()
+
+    def submit(self, batch) -> Future:
+        """
+        Queue faces for embedding
+        :param batch: the model input, shape (n, 1, 105, 105)
+        :return: a future of the embeddings, shape (n, embedding size)
+        """
+        future = Future()
+        self._queue.put((np.asarray(batch, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    def embed(self, batch) -> np.ndarray:
+        """
+        Embed faces through the scheduler, blocking until their batch ran
+        :param batch: the model input, shape (n, 1, 105, 105)
+        :return: the embeddings, shape (n, embedding size)
+        """
+        return self.submit(batch).result()
+
+    def metrics(self) -> dict:
+        """
+        :return: the number of batches, the mean batch size in faces and the mean and maximal queueing delay of
+            the requests in milliseconds
+        """
+        with self._metrics_lock:
+            return {'batches': self._batches, 'mean_batch': self._faces / max(1, self._batches),
+                    'mean_delay_ms': 1000 * self._delay / max(1, self._requests),
+                    'max_delay_ms': 1000 * self._max_delay}
+
+    def _collect(self):
+        """
+        Wait for a request and collect the requests arriving in its window
+        :return: the collected requests
+        """
+        requests = [self._queue.get()]
+        faces = len(requests[0][0])
+        deadline = time.perf_counter() + BatchScheduler.window_ms / 1000
+        while faces < BatchScheduler.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            faces += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            start = time.perf_counter()
+            try:
+                embeddings = self.engine.embed(np.concatenate([batch for batch, _, _ in requests]))
+            except Exception as e:
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for batch, future, _ in requests:
+                future.set_result(embeddings[offset: offset + len(batch)])
+                offset += len(batch)
+
+            with self._metrics_lock:
+                delays = [start - queued for _, _, queued in requests]
+                self._batches += 1
+                self._faces += offset
+                self._requests += len(requests)
+                self._delay += sum(delays)
+                self._max_delay = max(self._max_delay, max(delays))
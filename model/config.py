@@ -8,8 +8,11 @@ BATCH_SIZE = 128
 LEARNING_RATE = 0.0006
 INPUT_SHAPE = (1, 105, 105)
 INPUT_SIZE = (105, 105)
+EMBEDDING_SIZE = 4096   # the size of the SNN embeddings
 FINE_TUNE = True
 
+DETECTOR = 'mtcnn'     # face detector backend - 'mtcnn', 'haar' or 'cascade' (Haar first, MTCNN when unsure)
+
 TRAIN_DATASET_PATH = r'C:\LockMe_DATA\my_ATNT_DS\TRAIN'
 TEST_DATASET_PATH = r'C:\LockMe_DATA\my_ATNT_DS\TEST'
 
@@ -19,3 +22,24 @@ MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), MODEL_NAME
 OUT_NAME = r'model.pth'
 OUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), OUT_NAME)
 
+SCRIPTED_NAME = r'model-scripted.pt'    # frozen TorchScript artifact of MODEL_NAME, preferred when present
+SCRIPTED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTED_NAME)
+
+QUANTIZED_NAME = r'model-int8.pth'      # MODEL_NAME with the fc projection quantized to int8 (model/quantize.py)
+QUANTIZED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), QUANTIZED_NAME)
+
+LOW_RANK_NAME = r'model-low-rank.pth'   # MODEL_NAME with the fc projection factorized (model/low_rank.py)
+LOW_RANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), LOW_RANK_NAME)
+
+ONNX_EMBED_NAME = r'model-embed.onnx'   # ONNX export of MODEL_NAME's embedding network (model/export.py)
+ONNX_EMBED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ONNX_EMBED_NAME)
+ONNX_HEAD_NAME = r'model-head.onnx'     # ONNX export of MODEL_NAME's head
+ONNX_HEAD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ONNX_HEAD_NAME)
+
+INFERENCE_BACKEND = 'torch'     # 'torch' or 'onnx' (ONNX Runtime on CPU with the float ONNX models)
+
+# the model the applications run - 'float' (MODEL_NAME or its TorchScript artifact), 'int8' (QUANTIZED_NAME)
+# or 'low-rank' (LOW_RANK_NAME)
+INFERENCE_VARIANT = 'float'
+VARIANT_PATHS = {'float': MODEL_PATH, 'int8': QUANTIZED_PATH, 'low-rank': LOW_RANK_PATH}
+
@@ -9,10 +9,10 @@ import cv2 as cv
 import torch
 from torch.utils.data import Dataset, DataLoader, random_split
 import torchvision.datasets as datasets
-from facenet_pytorch import MTCNN
 
 import model.config as config
 import model.model_utils as utils
+from model.detector import FaceDetector
 
 
 class ModelDataset(Dataset):
@@ -107,11 +107,7 @@ class ModelDataset(Dataset):
         :param parent: the parent directory of all subjects
         """
         device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-        mtcnn = MTCNN(
-            image_size=160, margin=0, min_face_size=20,
-            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-            device=device
-        )
+        detector = FaceDetector.create(device=device)
         os.mkdir(new_path)
         people = os.listdir(parent)
         images = 0
@@ -123,8 +119,8 @@ class ModelDataset(Dataset):
             # valid = True
             # for j, file in enumerate(os.listdir(os.path.join(parent, p))):
             #     image = cv.imread(os.path.join(parent, p, file))
-            #     boxes, conf = mtcnn.detect(image)
-            #     if boxes is None or len(boxes) != 1:
+            #     boxes, conf = detector.detect(image)
+            #     if len(boxes) != 1:
             #         print(f'oops, get another image for {os.path.join(parent, p, file)}!')
             #         valid = False
             #         break
@@ -137,8 +133,8 @@ class ModelDataset(Dataset):
             sub_ind = 0
             for file in os.listdir(os.path.join(parent, p)):
                 image = cv.imread(os.path.join(parent, p, file))
-                boxes, conf = mtcnn.detect(image)
-                if boxes is None or len(boxes) != 1:
+                boxes, conf = detector.detect(image)
+                if len(boxes) != 1:
                     # print(f'oops, get another image for {os.path.join(parent, p, file)}!')
                     continue
                 boxes = boxes.astype(int)
@@ -186,16 +182,12 @@ class ModelDataset(Dataset):
             for file in os.listdir(folder):
                 files.append(os.path.join(folder, file))
         device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-        mtcnn = MTCNN(
-            image_size=160, margin=0, min_face_size=20,
-            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-            device=device
-        )
+        detector = FaceDetector.create(device=device)
 
         for file in files:
             image = cv.imread(file)
-            boxes, conf = mtcnn.detect(image)
-            if boxes is None or len(boxes) != 1:
+            boxes, conf = detector.detect(image)
+            if len(boxes) != 1:
                 print(file)
                 os.remove(file)
 
@@ -216,11 +208,7 @@ class ModelDataset(Dataset):
         cap = cv.VideoCapture(0)
         cntr = 0
         device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-        mtcnn = MTCNN(
-            image_size=160, margin=0, min_face_size=20,
-            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-            device=device
-        )
+        detector = FaceDetector.create(device=device)
 
         while True:
             ret, frame = cap.read()
@@ -232,7 +220,7 @@ class ModelDataset(Dataset):
 
             key = cv.waitKey(1)
             if key == ord('c'):
-                boxes, conf = mtcnn.detect(frame)
+                boxes, conf = detector.detect(frame)
                 boxes = boxes.astype(int)
                 boxes = [box for i, box in enumerate(boxes) if conf[i] >= 0.95]
 
@@ -258,11 +246,7 @@ class ModelDataset(Dataset):
         :param discover: discover faces from raw images - images not in the right format
         """
         device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-        mtcnn = MTCNN(
-            image_size=160, margin=0, min_face_size=20,
-            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-            device=device
-        )
+        detector = FaceDetector.create(device=device)
         cntr = 0
 
         folders = [name for name in os.listdir(self.ds_path) if os.path.isdir(os.path.join(self.ds_path, name))]
@@ -283,7 +267,7 @@ class ModelDataset(Dataset):
                     frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
 
                     frame = cv.resize(frame, (500, 500))
-                    boxes, conf = mtcnn.detect(frame)
+                    boxes, conf = detector.detect(frame)
                     boxes = boxes.astype(int)
                     boxes = [box for i, box in enumerate(boxes) if conf[i] >= 0.95]
 
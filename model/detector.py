@@ -0,0 +1,114 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import cv2 as cv
+
+import model.config as config
+from utils.logger import Logger
+from utils.messages import Messages as msg
+
+
+class FaceDetector(ABC):
+    """
+    Face detector interface. Every backend returns the bounding boxes in format (x1, y1, x2, y2), the format
+    ModelDataset.create_image consumes, with their confidences in [0, 1]
+    """
+    min_face_size = 20
+
+    @abstractmethod
+    def detect(self, image: np.ndarray):
+        """
+        Detect the faces of an image
+        :param image: the image (the channel order MTCNN was always given - RGB in the applications)
+        :return: the bounding boxes, shape (n, 4), and their confidences, shape (n, ). Empty arrays if no face found
+        """
+
+    @staticmethod
+    def empty():
+        return np.empty((0, 4)), np.empty(0)
+
+    @staticmethod
+    def create(name: str = None, device=None):
+        """
+        Create a detector backend
+        :param name: 'mtcnn', 'haar' or 'cascade' (Haar first, MTCNN when unsure), config.DETECTOR if not specified
+        :param device: the device MTCNN runs on
+        :return: a FaceDetector object
+        """
+        name = config.DETECTOR if name is None else name
+        match name:
+            case 'mtcnn':
+                return MTCNNDetector(device)
+            case 'haar':
+                return HaarDetector()
+            case 'cascade':
+                return CascadeDetector(HaarDetector(), MTCNNDetector(device))
+        Logger(msg.Errors.unknown_detector.format(name), Logger.exception).log()
+
+
+class MTCNNDetector(FaceDetector):
+    """
+    The MTCNN detector of facenet_pytorch - accurate but the slowest backend on CPU
+    """
+
+    def __init__(self, device=None):
+        # imported here so the deployments running only the Haar backend do not load facenet_pytorch
+        from facenet_pytorch import MTCNN
+        import torch
+        if device is None:
+            device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        self.mtcnn = MTCNN(
+            image_size=160, margin=0, min_face_size=FaceDetector.min_face_size,
+            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
+            device=device
+        )
+
+    def detect(self, image: np.ndarray):
+        boxes, conf = self.mtcnn.detect(image)
+        if boxes is None:
+            return FaceDetector.empty()
+        return boxes, conf
+
+
+class HaarDetector(FaceDetector):
+    """
+    OpenCV's frontal face Haar cascade, bundled with opencv-python - a lot cheaper than MTCNN on CPU.
+    The confidence is the final stage weight of the cascade divided by weight_scale and clipped to [0, 1],
+    it ranks the detections but is not a probability
+    """
+    cascade_file = 'haarcascade_frontalface_default.xml'
+    scale_factor = 1.1
+    min_neighbors = 5
+    weight_scale = 5.
+
+    def __init__(self):
+        self.classifier = cv.CascadeClassifier(cv.data.haarcascades + HaarDetector.cascade_file)
+
+    def detect(self, image: np.ndarray):
+        gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        rects, _, weights = self.classifier.detectMultiScale3(
+            gray, scaleFactor=HaarDetector.scale_factor, minNeighbors=HaarDetector.min_neighbors,
+            minSize=(FaceDetector.min_face_size, FaceDetector.min_face_size), outputRejectLevels=True)
+        if len(rects) == 0:
+            return FaceDetector.empty()
+        rects = np.asarray(rects, dtype=np.float64)
+        boxes = np.concatenate([rects[:, :2], rects[:, :2] + rects[:, 2:]], axis=1)
+        conf = np.clip(np.asarray(weights, dtype=np.float64).reshape(-1) / HaarDetector.weight_scale, 0., 1.)
+        return boxes, conf
+
+
+class CascadeDetector(FaceDetector):
+    """
+    Try a cheap detector first and fall back to an accurate one when the cheap detector finds no face
+    or is not confident in its best face
+    """
+    accept_confidence = 0.9
+
+    def __init__(self, cheap: FaceDetector, fallback: FaceDetector):
+        self.cheap = cheap
+        self.fallback = fallback
+
+    def detect(self, image: np.ndarray):
+        boxes, conf = self.cheap.detect(image)
+        if len(boxes) != 0 and conf.max() >= CascadeDetector.accept_confidence:
+            return boxes, conf
+        return self.fallback.detect(image)
@@ -0,0 +1,88 @@
+"""
+Compare a compressed inference model to the float model on a held-out folder of faces
+"""
+import time
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+import torchvision.datasets as datasets
+
+import model.config as config
+
+
+def load_faces(folder: str = config.TEST_DATASET_PATH):
+    """
+    Load a folder of face images in the dataset format (a sub folder of images per subject)
+    :param folder: path to the folder
+    :return: the model input of all the faces, shape (n, 1, 105, 105), and their subject labels, shape (n, )
+    """
+    transformation = transforms.Compose([
+        transforms.Grayscale(),
+        transforms.Resize(config.INPUT_SIZE),
+        transforms.ToTensor()
+    ])
+    dataset = datasets.ImageFolder(root=folder, transform=transformation)
+    faces = torch.stack([face for face, _ in dataset])
+    labels = np.array([label for _, label in dataset.imgs])
+    return faces, labels
+
+
+def embed_all(engine, faces: torch.Tensor, batch_size: int = 64):
+    """
+    Embed faces in batches
+    :param engine: an InferenceEngine object
+    :param faces: the model input, shape (n, 1, 105, 105)
+    :param batch_size: the number of faces per forward pass
+    :return: the embeddings, shape (n, embedding size), and the mean latency per face in milliseconds
+    """
+    start = time.perf_counter()
+    embeddings = np.concatenate([engine.embed(faces[i: i + batch_size]) for i in range(0, len(faces), batch_size)])
+    return embeddings, 1000 * (time.perf_counter() - start) / max(1, len(faces))
+
+
+def compare(reference, candidate, folder: str = config.TEST_DATASET_PATH, thresh: float = 0.5):
+    """
+    Compare the embeddings, the scores and the login decisions of two inference engines.
+    Every face logs in against all the other faces (leave-one-out), the decision is the subject of the best match
+    if its score is below the threshold, else a rejection
+    :param reference: the float InferenceEngine
+    :param candidate: the compressed InferenceEngine
+    :param folder: path to the held-out faces
+    :param thresh: the login distance threshold (User.dist_thresh)
+    :return: dictionary with the embedding cosine similarity, the score drift, the fraction of changed pair and
+        login decisions, the login accuracy of both engines and their embedding latencies
+    """
+    faces, labels = load_faces(folder)
+    ref, ref_latency = embed_all(reference, faces)
+    cand, cand_latency = embed_all(candidate, faces)
+
+    cosine = (ref * cand).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1) + 1e-12)
+    drift, pair_changes, login_changes = [], 0, 0
+    ref_correct, cand_correct = 0, 0
+    others = np.ones(len(faces), dtype=bool)
+    for i in range(len(faces)):
+        others[i] = False
+        ref_scores = reference.score(ref[i], ref[others])
+        cand_scores = candidate.score(cand[i], cand[others])
+        others[i] = True
+
+        drift.append(np.abs(ref_scores - cand_scores))
+        pair_changes += int(np.count_nonzero((ref_scores < thresh) != (cand_scores < thresh)))
+
+        other_labels = np.delete(labels, i)
+        decisions = []
+        for scores in (ref_scores, cand_scores):
+            best = np.argmin(scores)
+            decisions.append(other_labels[best] if scores[best] < thresh else None)
+        login_changes += int(decisions[0] != decisions[1])
+        ref_correct += int(decisions[0] == labels[i])
+        cand_correct += int(decisions[1] == labels[i])
+
+    drift = np.concatenate(drift) if drift else np.zeros(1)
+    n = max(1, len(faces))
+    return {'faces': len(faces),
+            'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min()),
+            'mean_score_drift': float(drift.mean()), 'max_score_drift': float(drift.max()),
+            'changed_pairs': pair_changes / max(1, len(drift)), 'changed_logins': login_changes / n,
+            'reference_accuracy': ref_correct / n, 'candidate_accuracy': cand_correct / n,
+            'reference_ms': ref_latency, 'candidate_ms': cand_latency}
@@ -0,0 +1,105 @@
+"""
+Export the trained model to deployment artifacts
+"""
+import os
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+
+import model.config as config
+from model.SNN import Net
+from model.inference import Embedder
+
+
+def export_torchscript(path: str = config.MODEL_PATH, out_path: str = config.SCRIPTED_PATH, runs: int = 20):
+    """
+    Export the embedding and the head scoring of a trained model to a frozen TorchScript artifact.
+    Freezing inlines the parameters and folds the batch normalization layers into the preceding convolutions
+    :param path: path to the state dictionary
+    :param out_path: path to the artifact
+    :param runs: number of timed single face embeddings for the comparison to the eager model
+    :return: dictionary with the maximal embedding difference from the eager model and both mean latencies in
+        milliseconds
+    """
+    net = Net()
+    net.load_state_dict(torch.load(path, map_location='cpu'))
+    embedder = Embedder(net).eval()
+    frozen = torch.jit.freeze(torch.jit.script(embedder), preserved_attrs=['score', 'head'])
+    torch.jit.save(frozen, out_path)
+
+    loaded = torch.jit.load(out_path)
+    sample = torch.rand((1, *config.INPUT_SHAPE))
+    with torch.inference_mode():
+        error = (loaded(sample) - embedder(sample)).abs().max().item()
+        latency = {}
+        for name, module in (('eager_ms', embedder), ('scripted_ms', loaded)):
+            module(sample)
+            start = time.perf_counter()
+            for _ in range(runs):
+                module(sample)
+            latency[name] = 1000 * (time.perf_counter() - start) / runs
+    return {'max_error': error, **latency}
+
+
+class OnnxHead(nn.Module):
+    """
+    The SNN head for the ONNX export - the scores of gallery embeddings against a probe, with the head parameters
+    as extra outputs so the runtime can read them without the torch checkpoint
+    """
+
+    def __init__(self, net: Net):
+        super().__init__()
+        self.fcOut = net.fcOut
+
+    def forward(self, gallery: torch.Tensor, probe: torch.Tensor):
+        return self.fcOut(torch.abs(gallery - probe)).view(-1), self.fcOut.weight.view(-1), self.fcOut.bias
+
+
+def export_onnx(path: str = config.MODEL_PATH, embed_path: str = config.ONNX_EMBED_PATH,
+                head_path: str = config.ONNX_HEAD_PATH):
+    """
+    Export the embedding network and the head of a trained model to ONNX, with a dynamic batch size
+    :param path: path to the state dictionary
+    :param embed_path: path to the embedding network ONNX model
+    :param head_path: path to the head ONNX model
+    :return: the maximal embedding and score differences between ONNX Runtime and torch
+    """
+    net = Net()
+    net.load_state_dict(torch.load(path, map_location='cpu'))
+    embedder, head = Embedder(net).eval(), OnnxHead(net).eval()
+
+    faces = torch.rand((2, *config.INPUT_SHAPE))
+    torch.onnx.export(embedder, (faces, ), embed_path, input_names=['faces'], output_names=['embeddings'],
+                      dynamic_axes={'faces': {0: 'batch'}, 'embeddings': {0: 'batch'}}, opset_version=17)
+    with torch.inference_mode():
+        embeddings = embedder(faces)
+    torch.onnx.export(head, (embeddings, embeddings[0]), head_path, input_names=['gallery', 'probe'],
+                      output_names=['scores', 'weight', 'bias'],
+                      dynamic_axes={'gallery': {0: 'n'}, 'scores': {0: 'n'}}, opset_version=17)
+
+    # ONNX Runtime is an optional dependency, needed here only to verify the export
+    from model.onnx_engine import OnnxEngine
+    engine = OnnxEngine(embed_path, head_path)
+    with torch.inference_mode():
+        scores = embedder.score(embeddings, embeddings[0]).numpy()
+    probe, gallery = embeddings[0].numpy(), embeddings.numpy()
+    return {'max_embedding_error': float(np.abs(engine.embed(faces) - gallery).max()),
+            'max_score_error': float(np.abs(engine.score(probe, gallery) - scores).max())}
+
+
+if __name__ == '__main__':
+    # python -m model.export [--onnx] - the ONNX export needs the optional onnx and onnxruntime packages
+    parser = argparse.ArgumentParser(description='Export the trained model to deployment artifacts')
+    parser.add_argument('--onnx', action='store_true', help='export the ONNX models instead of TorchScript')
+    if parser.parse_args().onnx:
+        report = export_onnx()
+        print(f'ONNX models saved to {config.ONNX_EMBED_PATH} and {config.ONNX_HEAD_PATH} - '
+              f'max embedding difference {report["max_embedding_error"]:.2e}, '
+              f'max score difference {report["max_score_error"]:.2e}')
+    else:
+        report = export_torchscript()
+        print(f'TorchScript model saved to {config.SCRIPTED_PATH} ({os.path.getsize(config.SCRIPTED_PATH)} bytes) - '
+              f'max embedding difference {report["max_error"]:.2e}, '
+              f'{report["eager_ms"]:.2f} ms eager vs {report["scripted_ms"]:.2f} ms scripted per face')
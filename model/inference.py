@@ -0,0 +1,114 @@
+import os
+from typing import Tuple
+import numpy as np
+import torch
+import torch.nn as nn
+
+import model.config as config
+from model.SNN import Net
+from model.variants import load_network, is_quantized
+
+
+class Embedder(nn.Module):
+    """
+    The inference part of the SNN: the embedding of faces and the head scoring of embeddings.
+    The module is scriptable, so the loaded network and the exported TorchScript artifact share one interface
+    """
+
+    def __init__(self, net: Net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        :param x: the model input, shape (N, 1, 105, 105)
+        :return: the embeddings, shape (N, embedding size)
+        """
+        return self.net.forward_once(x)
+
+    @torch.jit.export
+    def score(self, gallery: torch.Tensor, probe: torch.Tensor) -> torch.Tensor:
+        """
+        :param gallery: gallery embeddings, shape (n, embedding size)
+        :param probe: the probe embedding, shape (embedding size, )
+        :return: the head scores, shape (n, )
+        """
+        return self.net.fcOut(torch.abs(gallery - probe)).view(-1)
+
+    @torch.jit.export
+    def head(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        :return: the head weights and bias
+        """
+        return self.net.fcOut.weight, self.net.fcOut.bias
+
+
+class InferenceEngine:
+    """
+    Owns the loaded SNN for inference: the network is kept in evaluation mode (no drop-out, running batch
+    normalization statistics) and runs under torch.inference_mode, so no autograd graph is recorded and the same
+    faces always produce the same embeddings and scores
+    """
+    num_threads = min(4, os.cpu_count() or 1)   # intra-op threads, None keeps the torch default
+    warmup_batch = 2        # number of blank faces run through the network at load time
+
+    def __init__(self, net, device=None):
+        """
+        :param net: the loaded network - a Net, an Embedder or a TorchScript Embedder
+        :param device: the device to run on, CPU if not specified
+        """
+        self.device = torch.device('cpu') if device is None else device
+        if InferenceEngine.num_threads is not None:
+            torch.set_num_threads(InferenceEngine.num_threads)
+        if isinstance(net, Net):
+            net = Embedder(net)
+        self.net = net.to(self.device).eval()
+        weights, bias = self.net.head()
+        self.weights = weights.detach().cpu().numpy().reshape(-1)
+        self.bias = bias.item()
+        self.warm_up()
+
+    @staticmethod
+    def load(path: str = config.MODEL_PATH, device=None, scripted_path: str = None):
+        """
+        Load a trained network, preferring its TorchScript artifact when it is present and not older than the
+        checkpoint
+        :param path: path to the state dictionary or to a compressed variant checkpoint
+        :param device: the device to run on, quantized variants always run on CPU
+        :param scripted_path: path to the TorchScript artifact of the checkpoint, None to load the checkpoint
+        :return: an InferenceEngine object
+        """
+        if scripted_path is not None and os.path.exists(scripted_path) and \
+                (not os.path.exists(path) or os.path.getmtime(scripted_path) >= os.path.getmtime(path)):
+            return InferenceEngine(torch.jit.load(scripted_path, map_location=device), device)
+
+        net = load_network(torch.load(path, map_location='cpu'))
+        return InferenceEngine(net, None if is_quantized(net) else device)
+
+    def warm_up(self):
+        """
+        Run a blank batch through the network to allocate the buffers and select the kernels before the first login
+        """
+        if InferenceEngine.warmup_batch > 0:
+            self.embed(torch.zeros((InferenceEngine.warmup_batch, *config.INPUT_SHAPE)))
+
+    def embed(self, batch: torch.Tensor) -> np.ndarray:
+        """
+        Embed a batch of preprocessed faces
+        :param batch: the model input, shape (N, 1, 105, 105) - a tensor or an array
+        :return: the embeddings, shape (N, embedding size)
+        """
+        with torch.inference_mode():
+            return self.net(torch.as_tensor(batch).to(self.device)).cpu().numpy()
+
+    def score(self, probe, gallery: np.ndarray) -> np.ndarray:
+        """
+        Score a probe embedding against gallery embeddings with the SNN head
+        :param probe: the probe embedding, shape (embedding size, )
+        :param gallery: the gallery embeddings, shape (n, embedding size)
+        :return: the scores, shape (n, ) - lower is more similar
+        """
+        probe = torch.from_numpy(np.asarray(probe, dtype=np.float32)).to(self.device)
+        gallery = torch.from_numpy(np.asarray(gallery, dtype=np.float32)).to(self.device)
+        with torch.inference_mode():
+            return self.net.score(gallery, probe).cpu().numpy()
@@ -0,0 +1,95 @@
+"""
+Factorize the fc projection of the trained model to a low rank and compare the ranks
+"""
+import os
+import tempfile
+import torch
+import torch.nn as nn
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+from torch import optim
+from torch.optim.lr_scheduler import StepLR
+
+import model.config as config
+from model.inference import InferenceEngine
+from model.variants import load_network, factorize_fc, save_variant
+from model.evaluate import compare
+
+RANKS = (64, 128, 256, 512, 1024)
+RANK = 256              # the rank of the saved variant
+FINE_TUNE_EPOCHS = 0    # epochs of fine-tuning after the factorization, 0 to skip
+
+
+def factorize(path: str = config.MODEL_PATH, rank: int = RANK, out_path: str = None, epochs: int = 0):
+    """
+    Factorize the fc projection of a trained model
+    :param path: path to the float state dictionary
+    :param rank: the rank of the factorization
+    :param out_path: path to save the factorized checkpoint, not saved if not specified
+    :param epochs: number of epochs to fine-tune the factorized network on the training dataset
+    :return: the factorized network
+    """
+    net = factorize_fc(load_network(torch.load(path, map_location='cpu')), rank)
+    if epochs > 0:
+        fine_tune(net, epochs)
+    if out_path is not None:
+        save_variant(net.cpu(), 'low-rank', out_path, rank=rank)
+    return net.eval()
+
+
+def fine_tune(net, epochs: int):
+    """
+    Fine-tune a network with the training loop of model/train.py (which expects a 'checkpoints' folder in the
+    working directory)
+    :param net: the network to fine-tune
+    :param epochs: number of epochs
+    """
+    # the training modules import the training only dependencies (torchsummary, matplotlib)
+    from model.train import train
+    from model.dataset import ModelDataset
+
+    transformation = transforms.Compose([
+        transforms.Resize(config.INPUT_SIZE),
+        transforms.ToTensor()
+    ])
+    train_ds = ModelDataset(root=config.TRAIN_DATASET_PATH, transform=transformation)
+    valid_ds = ModelDataset(root=config.TEST_DATASET_PATH, transform=transformation)
+    train_loader = DataLoader(train_ds, batch_size=config.BATCH_SIZE, shuffle=True)
+    valid_loader = DataLoader(valid_ds, batch_size=config.BATCH_SIZE, shuffle=False)
+
+    criterion = nn.BCEWithLogitsLoss()
+    optimizer = optim.Adam(net.parameters(), lr=config.LEARNING_RATE / 10)    # stay close to the factorization
+    scheduler = StepLR(optimizer, step_size=2, gamma=0.99)
+    with tempfile.TemporaryDirectory() as directory:
+        # the factorized checkpoint is saved by the caller in the variant format
+        train(net, train_loader, valid_loader, optimizer, scheduler, criterion, epochs,
+              checkpoint_interval=epochs + 1, out_path=os.path.join(directory, 'fine-tuned.pth'), plot=False)
+
+
+def report(path: str = config.MODEL_PATH, ranks=RANKS, folder: str = config.TEST_DATASET_PATH):
+    """
+    Compare the factorization ranks to the float model on held-out faces
+    :param path: path to the float state dictionary
+    :param ranks: the ranks to evaluate
+    :param folder: path to the held-out faces
+    :return: {rank: {'parameters': ..., 'reference_ms': ..., 'candidate_ms': ..., 'candidate_accuracy': ...}} with
+        all the fields of model.evaluate.compare
+    """
+    reference = InferenceEngine.load(path)
+    results = {}
+    for rank in ranks:
+        net = factorize(path, rank)
+        results[rank] = {'parameters': sum(p.numel() for p in net.parameters()),
+                         **compare(reference, InferenceEngine(net), folder)}
+    return results
+
+
+if __name__ == '__main__':
+    print(f'float model - {sum(p.numel() for p in load_network(torch.load(config.MODEL_PATH)).parameters())} '
+          f'parameters')
+    for rank, result in report().items():
+        print(f'rank {rank}: {result["parameters"]} parameters, {result["candidate_ms"]:.2f} ms per face '
+              f'({result["reference_ms"]:.2f} ms float), login accuracy {result["candidate_accuracy"]:.3f} '
+              f'({result["reference_accuracy"]:.3f} float), changed logins {result["changed_logins"]:.3f}')
+    factorize(rank=RANK, out_path=config.LOW_RANK_PATH, epochs=FINE_TUNE_EPOCHS)
+    print(f'rank {RANK} model saved to {config.LOW_RANK_PATH}')
@@ -0,0 +1,58 @@
+import numpy as np
+import onnxruntime as ort
+
+import model.config as config
+
+
+class OnnxEngine:
+    """
+    Inference backend running the ONNX exports of the SNN (model/export.py) with ONNX Runtime on CPU.
+    Exposes the interface of InferenceEngine without depending on torch
+    """
+    providers = ('CPUExecutionProvider', )
+    num_threads = None      # intra-op threads, None lets ONNX Runtime decide
+    warmup_batch = 2
+
+    def __init__(self, embed_path: str = config.ONNX_EMBED_PATH, head_path: str = config.ONNX_HEAD_PATH):
+        """
+        :param embed_path: path to the embedding network ONNX model
+        :param head_path: path to the head ONNX model
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if OnnxEngine.num_threads is not None:
+            options.intra_op_num_threads = OnnxEngine.num_threads
+        self.embed_session = ort.InferenceSession(embed_path, options, providers=list(OnnxEngine.providers))
+        self.head_session = ort.InferenceSession(head_path, options, providers=list(OnnxEngine.providers))
+
+        dim = self.head_session.get_inputs()[1].shape[0]
+        blank = np.zeros((1, dim), dtype=np.float32)
+        weights, bias = self.head_session.run(['weight', 'bias'], {'gallery': blank, 'probe': blank[0]})
+        self.weights = weights.reshape(-1)
+        self.bias = float(bias.reshape(-1)[0])
+        self.warm_up()
+
+    def warm_up(self):
+        """
+        Run a blank batch through the network before the first login
+        """
+        if OnnxEngine.warmup_batch > 0:
+            self.embed(np.zeros((OnnxEngine.warmup_batch, *config.INPUT_SHAPE), dtype=np.float32))
+
+    def embed(self, batch) -> np.ndarray:
+        """
+        Embed a batch of preprocessed faces
+        :param batch: the model input, shape (N, 1, 105, 105) - an array or a CPU tensor
+        :return: the embeddings, shape (N, embedding size)
+        """
+        return self.embed_session.run(['embeddings'], {'faces': np.asarray(batch, dtype=np.float32)})[0]
+
+    def score(self, probe, gallery: np.ndarray) -> np.ndarray:
+        """
+        Score a probe embedding against gallery embeddings with the SNN head
+        :param probe: the probe embedding, shape (embedding size, )
+        :param gallery: the gallery embeddings, shape (n, embedding size)
+        :return: the scores, shape (n, ) - lower is more similar
+        """
+        return self.head_session.run(['scores'], {'gallery': np.asarray(gallery, dtype=np.float32),
+                                                  'probe': np.asarray(probe, dtype=np.float32)})[0]
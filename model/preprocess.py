@@ -0,0 +1,103 @@
+import threading
+import numpy as np
+import cv2 as cv
+from PIL import Image
+
+import model.config as config
+
+
+class FacePreprocessor:
+    """
+    Turn a captured frame and face bounding boxes into the normalized model input batch. The canvas buffers are
+    reused per thread, so one preprocessor may serve concurrent threads, and every call returns a batch of its own.
+    The steps are those of ModelDataset.create_image followed by Net.preprocess_image in the same order -
+    the face crop is resized onto a white square canvas keeping its aspect ratio, converted to gray and resized to
+    the model input - so the result is identical to the original pipeline. Only the full frame color conversion,
+    the canvas allocation and the gray round trip of the original pipeline are skipped.
+    The batches are NumPy arrays, so the preprocessing does not load torch (both inference backends take arrays)
+    """
+    canvas_size = 300   # the canvas size of ModelDataset.create_image, keeps the geometry of the original pipeline
+    parity_tolerance = 1e-6     # accepted absolute pixel difference from the original pipeline
+
+    def __init__(self, size=config.INPUT_SIZE):
+        """
+        :param size: the model input size (height, width)
+        """
+        self.height, self.width = size
+        self._buffers = threading.local()   # the canvas and gray canvas of every thread
+
+    def __call__(self, frame: np.ndarray, boxes) -> np.ndarray:
+        """
+        Preprocess the faces of a frame
+        :param frame: the captured frame (BGR)
+        :param boxes: face bounding boxes in format (x1, y1, x2, y2)
+        :return: the model input batch, shape (N, 1, height, width)
+        """
+        batch = np.empty((len(boxes), 1, self.height, self.width), dtype=np.float32)
+        for i, box in enumerate(boxes):
+            face = self._place(frame, box)
+            np.divide(face, np.float32(255), out=batch[i, 0])
+        return batch
+
+    def _place(self, frame: np.ndarray, box) -> np.ndarray:
+        """
+        Crop a face, fit it into the white canvas, convert it to gray and resize it to the model input
+        :param frame: the captured frame (BGR)
+        :param box: face bounding box in format (x1, y1, x2, y2)
+        :return: the face, shape (height, width), uint8
+        """
+        x1, y1, x2, y2 = box
+        h, w = frame.shape[:2]
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(w, x2), min(h, y2)
+
+        width, height = x2 - x1, y2 - y1
+        prop = width / height
+        size = FacePreprocessor.canvas_size
+        if width > height:
+            fit_w, fit_h = size, int(size / prop)
+        else:
+            fit_w, fit_h = int(prop * size), size
+        start_x, start_y = (size - fit_w) // 2, (size - fit_h) // 2
+
+        if not hasattr(self._buffers, 'canvas'):
+            self._buffers.canvas = np.empty((size, size, 3), dtype=np.uint8)
+            self._buffers.gray = np.empty((size, size), dtype=np.uint8)
+        canvas, gray = self._buffers.canvas, self._buffers.gray
+        canvas.fill(255)
+        canvas[start_y: start_y + fit_h, start_x: start_x + fit_w] = cv.resize(frame[y1: y2, x1: x2], (fit_w, fit_h))
+        # the original pipeline converts an RGB ordered image with BGR2GRAY, which is RGB2GRAY on the BGR frame
+        cv.cvtColor(canvas, cv.COLOR_RGB2GRAY, dst=gray)
+        # the resize of Net.preprocess_image (torchvision resizes PIL images with PIL)
+        return np.asarray(Image.fromarray(gray).resize((self.width, self.height), Image.BILINEAR))
+
+    @staticmethod
+    def reference(frame: np.ndarray, box) -> np.ndarray:
+        """
+        Preprocess a face with the original pipeline
+        :param frame: the captured frame (BGR)
+        :param box: face bounding box in format (x1, y1, x2, y2)
+        :return: the model input, shape (1, height, width)
+        """
+        # the original pipeline runs on torch and torchvision, imported only for the parity check
+        from model.dataset import ModelDataset
+        from model.SNN import Net
+        image = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+        x_aligned = ModelDataset.create_image(image, box)
+        x_aligned = cv.cvtColor(x_aligned, cv.COLOR_GRAY2BGR)
+        return Net.preprocess_image(x_aligned).numpy()
+
+    def check_parity(self, frame: np.ndarray, boxes) -> dict:
+        """
+        Compare the preprocessing of the faces of a frame to the original pipeline
+        :param frame: the captured frame (BGR)
+        :param boxes: face bounding boxes in format (x1, y1, x2, y2)
+        :return: the maximal and mean absolute pixel difference over all the faces and whether the maximal
+            difference is within the tolerance
+        """
+        batch = self(frame, boxes)
+        errors = [np.abs(batch[i] - FacePreprocessor.reference(frame, box)) for i, box in enumerate(boxes)]
+        max_error = max(float(error.max()) for error in errors)
+        mean_error = float(np.mean([float(error.mean()) for error in errors]))
+        return {'max_error': max_error, 'mean_error': mean_error,
+                'passed': max_error <= FacePreprocessor.parity_tolerance}
@@ -0,0 +1,31 @@
+"""
+Convert the trained model to the int8 variant and compare it to the float model
+"""
+import os
+import torch
+
+import model.config as config
+from model.inference import InferenceEngine
+from model.variants import load_network, quantize_fc, save_variant
+from model.evaluate import compare
+
+
+def convert(path: str = config.MODEL_PATH, out_path: str = config.QUANTIZED_PATH):
+    """
+    Quantize the fc projection of a trained model and save the int8 checkpoint
+    :param path: path to the float state dictionary
+    :param out_path: path to the int8 checkpoint
+    :return: the quantized network
+    """
+    net = quantize_fc(load_network(torch.load(path, map_location='cpu')))
+    save_variant(net, 'int8', out_path)
+    return net
+
+
+if __name__ == '__main__':
+    convert()
+    print(f'int8 model saved to {config.QUANTIZED_PATH} - {os.path.getsize(config.QUANTIZED_PATH)} bytes '
+          f'(float model {os.path.getsize(config.MODEL_PATH)} bytes)')
+    report = compare(InferenceEngine.load(config.MODEL_PATH), InferenceEngine.load(config.QUANTIZED_PATH))
+    for key, value in report.items():
+        print(f'{key}: {value}')
@@ -5,7 +5,6 @@ from torch.utils.data import DataLoader
 from torch import optim
 from torch.optim.lr_scheduler import StepLR
 from torchsummary import summary
-from facenet_pytorch import MTCNN
 import cv2 as cv
 import os
 import matplotlib.pyplot as plt
@@ -13,12 +12,14 @@ import matplotlib.pyplot as plt
 from utils.logger import Logger
 from dataset import ModelDataset
 from SNN import Net
+from detector import FaceDetector
 import config
 import model_utils as utils
 
 
 def train(net, train_loader: DataLoader, valid_loader: DataLoader,
-          optimizer: optim, scheduler, criterion, epochs: int, checkpoint_interval: int = 5):
+          optimizer: optim, scheduler, criterion, epochs: int, checkpoint_interval: int = 5,
+          out_path: str = config.OUT_PATH, plot: bool = True):
     """
     Train the network
     :param net: the network to train
@@ -29,6 +30,8 @@ def train(net, train_loader: DataLoader, valid_loader: DataLoader,
     :param criterion: the loss function
     :param epochs: number of epochs to train
     :param checkpoint_interval: number of epochs between checkpoints
+    :param out_path: path to the trained state dictionary
+    :param plot: plot the loss and the accuracy of the epochs
     """
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     net.to(device)
@@ -116,7 +119,9 @@ def train(net, train_loader: DataLoader, valid_loader: DataLoader,
             torch.save(net.state_dict(), checkpoint_path)
             print(f'Saved checkpoint at epoch {epoch + suffix + 1}: {checkpoint_path}')
 
-    torch.save(net.state_dict(), config.OUT_PATH)
+    torch.save(net.state_dict(), out_path)
+    if not plot:
+        return
 
     # Plotting the results
     plt.figure(figsize=(10, 4))
@@ -148,11 +153,7 @@ def try_it(path=None):
     Utility function for experiencing the network
     """
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-    mtcnn = MTCNN(
-        image_size=160, margin=0, min_face_size=20,
-        thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-        device=device
-    )
+    detector = FaceDetector.create(device=device)
     # load the saved parameters
     if path is None:
         state_dict = torch.load(config.MODEL_PATH)
@@ -176,8 +177,8 @@ def try_it(path=None):
 
         key = cv.waitKey(1)
         if key == ord('a'):
-            boxes, conf = mtcnn.detect(frame)
-            if boxes is None:
+            boxes, conf = detector.detect(frame)
+            if len(boxes) == 0:
                 print('try again')
                 continue
             boxes = boxes.astype(int)
@@ -186,7 +187,7 @@ def try_it(path=None):
             frame1 = ModelDataset.create_image(frame, boxes[0])
             frame1 = cv.cvtColor(frame1, cv.COLOR_GRAY2BGR)
         if key == ord('b') and frame1 is not None:
-            boxes, conf = mtcnn.detect(frame)
+            boxes, conf = detector.detect(frame)
             boxes = boxes.astype(int)
             boxes = [box for i, box in enumerate(boxes) if conf[i] >= 0.85]
 
@@ -0,0 +1,86 @@
+"""
+Compressed variants of the SNN and their checkpoint format.
+A variant checkpoint is a dictionary {'variant': name, 'state_dict': ...} with the variant's extra parameters,
+a plain state dictionary is the float model
+"""
+import torch
+import torch.nn as nn
+
+from model.SNN import Net
+from utils.logger import Logger
+from utils.messages import Messages as msg
+
+
+def quantize_fc(net: Net) -> Net:
+    """
+    Quantize the weights of the fc projection to int8 with dynamic quantization - the activations are quantized on
+    the fly, so no calibration data is needed. The head (fcOut) stays in float, so the scores of given embeddings
+    are unchanged. Runs on CPU only
+    :param net: a float network
+    :return: the quantized network
+    """
+    return torch.ao.quantization.quantize_dynamic(net.eval(), {'fc'}, dtype=torch.qint8)
+
+
+def factorize_fc(net: Net, rank: int, decompose: bool = True) -> Net:
+    """
+    Replace the fc projection W (4096 x 9216) by two thinner layers of the given rank with the truncated SVD
+    W ~ (U * sqrt(S)) (sqrt(S) * V^T), which keeps rank * (9216 + 4096) weights instead of 9216 * 4096
+    :param net: a float network
+    :param rank: the rank of the factorization
+    :param decompose: initialize the layers from the SVD of the current weights, False only builds the structure
+        (for loading a saved factorized network)
+    :return: the network with the factorized projection
+    """
+    linear = net.fc[0]
+    first = nn.Linear(linear.in_features, rank, bias=False)
+    second = nn.Linear(rank, linear.out_features)
+    if decompose:
+        with torch.no_grad():
+            u, s, vh = torch.linalg.svd(linear.weight, full_matrices=False)
+            root = s[:rank].sqrt()
+            first.weight.copy_(root[:, None] * vh[:rank])
+            second.weight.copy_(u[:, :rank] * root[None, :])
+            second.bias.copy_(linear.bias)
+    net.fc[0] = nn.Sequential(first, second)
+    return net
+
+
+def save_variant(net: Net, variant: str, path: str, **params):
+    """
+    Save a compressed network
+    :param net: the compressed network
+    :param variant: the variant name
+    :param path: path to the checkpoint
+    :param params: the parameters needed to rebuild the variant's structure
+    """
+    torch.save({'variant': variant, 'state_dict': net.state_dict(), **params}, path)
+
+
+def load_network(checkpoint: dict) -> Net:
+    """
+    Build a network from a float state dictionary or a variant checkpoint
+    :param checkpoint: the loaded checkpoint
+    :return: the network
+    """
+    if 'variant' not in checkpoint:
+        net = Net()
+        net.load_state_dict(checkpoint)
+        return net
+
+    match checkpoint['variant']:
+        case 'int8':
+            net = quantize_fc(Net())
+        case 'low-rank':
+            net = factorize_fc(Net(), checkpoint['rank'], decompose=False)
+        case _:
+            Logger(msg.Errors.unknown_variant.format(checkpoint['variant']), Logger.exception).log()
+    net.load_state_dict(checkpoint['state_dict'])
+    return net
+
+
+def is_quantized(net: nn.Module) -> bool:
+    """
+    :return: if the network has dynamically quantized layers, which run on CPU only
+    """
+    return any(type(module).__module__.startswith('torch.ao.nn.quantized') for module in net.modules())
@@ -0,0 +1,241 @@
+"""
+Local recognition service - keeps the face detector and the SNN loaded in a long running process and answers
+detection and embedding requests of the applications over a local authenticated connection.
+Run it with `python recognition_service.py` before starting the applications; they fall back to loading the models
+in process when no service is running, or once the running service is lost.
+The database stays owned by the application process: it is decrypted when opened and encrypted back when closed,
+so the users are identified against the application's own gallery with the head weights served by the service.
+The requests are pickled, so the service only accepts the clients holding its key - the key file is readable only by
+its owner (on Windows it inherits the access rights of the databases directory)
+"""
+import os
+import secrets
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+from model.detector import FaceDetector
+from model.batching import BatchScheduler
+from utils.logger import Logger
+from utils.messages import Messages as msg
+
+
+class RecognitionServer:
+    """
+    The recognition service process
+    """
+    address = ('localhost', 6550)
+    key_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases', 'service.key')
+
+    def __init__(self, detector, engine):
+        """
+        :param detector: a FaceDetector object
+        :param engine: an InferenceEngine (or OnnxEngine) object
+        """
+        self.detector = detector
+        self.engine = engine
+        self.scheduler = BatchScheduler(engine)     # the embeddings of concurrent clients run in shared batches
+        self._lock = threading.Lock()
+
+    def serve(self):
+        """
+        Accept the clients until interrupted, every client is served by its own thread
+        """
+        authkey = secrets.token_bytes(32)
+        # bind first - a second instance fails here and leaves the key of the running service in place
+        with Listener(RecognitionServer.address, authkey=authkey) as listener:
+            RecognitionServer.write_key(authkey)
+            try:
+                Logger(msg.Info.service_started + f' {RecognitionServer.address}', Logger.info).log()
+                while True:
+                    try:
+                        connection = listener.accept()
+                    except Exception as e:  # failed authentication of a client
+                        Logger(e, Logger.inform).log()
+                        continue
+                    threading.Thread(target=self.handle, args=(connection, ), daemon=True).start()
+            finally:
+                if RecognitionServer.read_key() == authkey:
+                    os.remove(RecognitionServer.key_path)
+
+    @staticmethod
+    def write_key(authkey: bytes):
+        """
+        Atomically write the key file, readable only by its owner
+        :param authkey: the service key
+        """
+        directory = os.path.dirname(RecognitionServer.key_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory)     # created with mode 0o600
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(authkey)
+        os.replace(temp_path, RecognitionServer.key_path)
+
+    @staticmethod
+    def read_key():
+        """
+        :return: the key of the running service, None if there is none
+        """
+        try:
+            with open(RecognitionServer.key_path, 'rb') as key_file:
+                return key_file.read()
+        except OSError:
+            return None
+
+    def handle(self, connection):
+        """
+        Answer the requests of a client until it disconnects
+        :param connection: the client connection
+        """
+        with connection:
+            while True:
+                try:
+                    command, *args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    connection.send(('ok', self.run(command, *args)))
+                except Exception as e:
+                    connection.send(('error', str(e)))
+
+    def run(self, command: str, *args):
+        """
+        Execute a request
+        :param command: 'head', 'detect', 'embed' or 'metrics'
+        :param args: the request arguments
+        :return: the result
+        """
+        match command:
+            case 'head':
+                return self.engine.weights, self.engine.bias
+            case 'detect':
+                with self._lock:    # the detector runs one request at a time
+                    return self.detector.detect(*args)
+            case 'embed':
+                return self.scheduler.embed(*args)
+            case 'metrics':
+                return self.scheduler.metrics()
+        raise ValueError(f'Unknown request: {command}')
+
+
+class RecognitionClient:
+    """
+    A connection to the recognition service
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _open():
+        """
+        :return: a connection to the running recognition service, None if no service is running
+        """
+        authkey = RecognitionServer.read_key()
+        if authkey is None:
+            return None
+        try:
+            return Client(RecognitionServer.address, authkey=authkey)
+        except (OSError, EOFError, AuthenticationError):
+            return None
+
+    @staticmethod
+    def connect():
+        """
+        Connect to the running recognition service
+        :return: a RecognitionClient object, None if no service is running
+        """
+        connection = RecognitionClient._open()
+        return None if connection is None else RecognitionClient(connection)
+
+    def request(self, command: str, *args):
+        """
+        Send a request and wait for the result, reconnecting once if the connection was lost
+        :param command: the request name
+        :param args: the request arguments
+        :return: the result
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    self._connection.send((command, *args))
+                    status, result = self._connection.recv()
+                    break
+                except (EOFError, OSError):
+                    connection = RecognitionClient._open() if attempt == 0 else None
+                    if connection is None:
+                        raise ConnectionError(msg.Errors.service_lost)
+                    self._connection = connection
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+
+class RemoteDetector(FaceDetector):
+    """
+    Face detection by the recognition service, in process once the service is lost
+    """
+
+    def __init__(self, client: RecognitionClient, fallback):
+        """
+        :param client: the service connection
+        :param fallback: a function building the in-process detector
+        """
+        self.client = client
+        self.fallback = fallback
+        self.local = None
+
+    def detect(self, image: np.ndarray):
+        if self.local is None:
+            try:
+                return self.client.request('detect', image)
+            except ConnectionError as e:
+                Logger(e, Logger.warning).log()
+                self.local = self.fallback()
+        return self.local.detect(image)
+
+
+class RemoteEngine:
+    """
+    The InferenceEngine interface over the recognition service - the faces are embedded by the service and the
+    scores are computed locally with the head weights (the head is a weighted L1 distance).
+    The faces are embedded in process once the service is lost
+    """
+
+    def __init__(self, client: RecognitionClient, fallback):
+        """
+        :param client: the service connection
+        :param fallback: a function building the in-process engine
+        """
+        self.client = client
+        self.fallback = fallback
+        self.local = None
+        try:
+            weights, bias = client.request('head')
+        except ConnectionError as e:
+            Logger(e, Logger.warning).log()
+            self.local = fallback()
+            weights, bias = self.local.weights, self.local.bias
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+
+    def embed(self, batch) -> np.ndarray:
+        if self.local is None:
+            try:
+                return self.client.request('embed', np.asarray(batch, dtype=np.float32))
+            except ConnectionError as e:
+                Logger(e, Logger.warning).log()
+                self.local = self.fallback()
+        return np.asarray(self.local.embed(batch))
+
+    def score(self, probe, gallery: np.ndarray) -> np.ndarray:
+        probe = np.asarray(probe, dtype=np.float32)
+        return np.abs(np.asarray(gallery, dtype=np.float32) - probe) @ self.weights + self.bias
+
+
+if __name__ == '__main__':
+    from utils.initialize import Init
+    RecognitionServer(Init.build_local_detector(), Init.build_local_engine()).serve()
@@ -0,0 +1,130 @@
+import numpy as np
+
+from gallery import Gallery
+
+
+class DimensionReduction:
+    """
+    Reduce the embeddings to the K dimensions that matter most for the SNN head score.
+    The head scores a pair by a weighted L1 distance, so the score of the reduced vectors is the partial sum over the
+    selected dimensions plus the expected contribution of the dropped dimensions.
+    Two selection modes are supported:
+    'weight' - the K largest |weight| dimensions of the head
+    'variance' - the K dimensions with the largest |weight| * std on an enrollment sample
+    """
+    k = None            # set to the number of dimensions to scan logins with reduced embeddings
+    mode = 'weight'
+
+    def __init__(self, weights, bias: float, k: int, mode: str = 'weight', sample: np.ndarray = None):
+        """
+        :param weights: the SNN head (fcOut) weights, shape (embedding size, )
+        :param bias: the SNN head bias
+        :param k: the number of dimensions to keep
+        :param mode: 'weight' or 'variance'
+        :param sample: enrollment embeddings, shape (m, embedding size). Required by the 'variance' mode and used to
+            estimate the contribution of the dropped dimensions
+        """
+        weights = np.asarray(weights, dtype=np.float32).reshape(-1)
+        if mode == 'variance' and sample is not None and len(sample) > 1:
+            significance = np.abs(weights) * np.asarray(sample, dtype=np.float32).std(axis=0)
+        else:
+            significance = np.abs(weights)
+        k = min(k, len(weights))
+        self.dims = np.sort(np.argpartition(-significance, k - 1)[:k])
+        self.weights = weights[self.dims]
+        self.bias = float(bias)
+
+        # expected contribution of the dropped dimensions - E|x - y| over pairs of the sample
+        dropped = np.ones(len(weights), dtype=bool)
+        dropped[self.dims] = False
+        if sample is not None and len(sample) > 1:
+            sample = np.asarray(sample, dtype=np.float32)[:, dropped]
+            pairs = np.random.default_rng(0).integers(0, len(sample), size=(min(1024, len(sample) ** 2), 2))
+            self.bias += float(np.abs(sample[pairs[:, 0]] - sample[pairs[:, 1]]).mean(axis=0) @ weights[dropped])
+
+    def reduce(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        :param embeddings: full embeddings, shape (..., embedding size)
+        :return: the reduced embeddings, shape (..., K)
+        """
+        return np.asarray(embeddings, dtype=np.float32)[..., self.dims]
+
+    def score(self, reduced: np.ndarray, probe) -> np.ndarray:
+        """
+        Approximate the SNN head score with reduced embeddings
+        :param reduced: reduced gallery embeddings, shape (n, K)
+        :param probe: the full probe embedding
+        :return: the approximated scores, shape (n, )
+        """
+        return np.abs(reduced - self.reduce(probe)) @ self.weights + self.bias
+
+    @staticmethod
+    def report(weights, bias: float, sample: np.ndarray, ks=(64, 128, 256, 512, 1024, 2048), mode: str = 'weight'):
+        """
+        Evaluate the score error of the reduced embeddings for several values of K over pairs of the sample
+        :param weights: the SNN head weights
+        :param bias: the SNN head bias
+        :param sample: embeddings to build pairs from, shape (m, embedding size)
+        :param ks: the values of K to evaluate
+        :param mode: the selection mode
+        :return: {K: {'mean_error': ..., 'max_error': ..., 'speedup': embedding size / K}}
+        """
+        weights = np.asarray(weights, dtype=np.float32).reshape(-1)
+        sample = np.asarray(sample, dtype=np.float32)
+        full = np.stack([np.abs(sample - probe) @ weights + bias for probe in sample])
+        report = {}
+        for k in ks:
+            reduction = DimensionReduction(weights, bias, k, mode, sample)
+            reduced = reduction.reduce(sample)
+            approx = np.stack([reduction.score(reduced, probe) for probe in sample])
+            error = np.abs(approx - full)
+            report[k] = {'mean_error': float(error.mean()), 'max_error': float(error.max()),
+                         'speedup': len(weights) / len(reduction.dims)}
+        return report
+
+
+class ReducedGallery:
+    """
+    Reduced copy of a gallery, kept row-aligned with it, which is scanned to shortlist the rows scored exactly
+    """
+    rerank = 8      # number of shortlisted rows re-scored with the full embeddings
+
+    def __init__(self, reduction: DimensionReduction):
+        self.reduction = reduction
+        self.source = None
+        self.gallery = Gallery(len(reduction.dims))
+
+    def attach(self, source):
+        """
+        Follow a full gallery
+        :param source: a Gallery object
+        """
+        self.source = source
+        source.observers.append(self)
+        self.on_load(source.uids, source.matrix)
+
+    def on_load(self, uids, matrix):
+        self.gallery.load(self.source.uids, self.reduction.reduce(self.source.embeddings()))
+
+    def on_add(self, uid: int, embedding):
+        self.gallery.add(uid, self.reduction.reduce(embedding))
+
+    def on_remove(self, uid: int, rows: np.ndarray):
+        self.gallery.remove(uid)
+
+    def shortlist(self, probe, rows: np.ndarray = None, n: int = None) -> np.ndarray:
+        """
+        Scan the reduced gallery and keep the best rows
+        :param probe: the full probe embedding
+        :param rows: the rows to scan, all rows if not specified
+        :param n: the number of rows to keep, rerank by default
+        :return: the kept row indices of the full gallery
+        """
+        n = ReducedGallery.rerank if n is None else n
+        matrix = self.gallery.matrix if rows is None else self.gallery.matrix[rows]
+        if rows is None:
+            rows = np.arange(len(matrix))
+        if len(rows) <= n:
+            return rows
+        scores = self.reduction.score(matrix, probe)
+        return np.sort(rows[np.argpartition(scores, n - 1)[:n]])
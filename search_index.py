@@ -0,0 +1,148 @@
+import time
+import numpy as np
+
+from utils.logger import Logger
+from utils.messages import Messages as msg
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour index over the gallery for the SNN scoring metric.
+    The SNN head scores a pair by a learned weighted L1 distance, so the embeddings are rescaled by the absolute head
+    weights and bucketed with a k-means coarse quantizer (IVF). A query only scans the lists of the n_probe closest
+    centroids and returns a small candidate set which is then re-scored exactly by the SNN head.
+    """
+    min_size = 256          # galleries smaller than this are scanned exactly
+    n_probe = 4             # number of lists scanned per query - higher is better recall but slower
+    list_size = 64          # target number of rows per list, controls the number of lists
+    train_iterations = 10
+    rebuild_factor = 2.0    # rebuild once the gallery grew by this factor since the last build
+
+    def __init__(self, weights, bias: float = 0.):
+        """
+        :param weights: the SNN head (fcOut) weights, shape (embedding size, )
+        :param bias: the SNN head bias
+        """
+        self.weights = np.asarray(weights, dtype=np.float32).reshape(-1)
+        self.bias = float(bias)
+        self.scale = np.abs(self.weights)
+        self.gallery = None
+        self.centroids = None
+        self._lists = []        # the inverted lists of gallery row indices
+        self._built_size = 0
+
+    def attach(self, gallery):
+        """
+        Build the index on a gallery and keep it updated with every enrollment or deletion
+        :param gallery: a Gallery object
+        """
+        self.gallery = gallery
+        gallery.observers.append(self)
+        self.build()
+
+    def detach(self):
+        """
+        Stop following the gallery
+        """
+        if self.gallery is not None:
+            self.gallery.observers.remove(self)
+            self.gallery = None
+
+    def _nearest_lists(self, vectors: np.ndarray, n: int = 1) -> np.ndarray:
+        """
+        Find the nearest centroids of rescaled vectors
+        :param vectors: the rescaled vectors, shape (m, dim)
+        :param n: number of centroids to return per vector
+        :return: the centroids indices, shape (m, n)
+        """
+        dist = (self.centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ self.centroids.T
+        if n >= len(self.centroids):
+            return np.argsort(dist, axis=1)
+        nearest = np.argpartition(dist, n - 1, axis=1)[:, :n]
+        return nearest
+
+    @Logger(msg.Info.index_built, Logger.info).time_it
+    def build(self):
+        """
+        (Re)build the coarse quantizer and the inverted lists from the attached gallery
+        """
+        uids = self.gallery.uids
+        self._built_size = len(uids)
+        if len(uids) < IVFIndex.min_size:
+            self.centroids = None
+            self._lists = []
+            return
+
+        data = self.gallery.embeddings() * self.scale
+        n_lists = max(1, len(uids) // IVFIndex.list_size)
+        rng = np.random.default_rng(0)
+        self.centroids = data[rng.choice(len(data), n_lists, replace=False)].copy()
+
+        # k-means with the squared L2 distance
+        assign = None
+        for _ in range(IVFIndex.train_iterations):
+            assign = self._nearest_lists(data)[:, 0]
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=n_lists)
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+        assign = self._nearest_lists(data)[:, 0]
+        order = np.argsort(assign, kind='stable')
+        self._lists = np.split(order, np.cumsum(np.bincount(assign, minlength=n_lists))[:-1])
+
+    def on_load(self, uids, matrix):
+        self.build()
+
+    def on_add(self, uid: int, embedding):
+        if len(self.gallery) >= max(IVFIndex.min_size, self._built_size * IVFIndex.rebuild_factor):
+            self.build()
+        elif self.centroids is not None:
+            vector = np.asarray(embedding, dtype=np.float32)[None, :] * self.scale
+            i = self._nearest_lists(vector)[0, 0]
+            self._lists[i] = np.append(self._lists[i], len(self.gallery) - 1)
+
+    def on_remove(self, uid: int, rows: np.ndarray):
+        if self.centroids is None:
+            return
+        # the gallery keeps the order of the remaining rows, so every row moves up by the removed rows before it
+        removed = np.zeros(len(self.gallery) + len(rows), dtype=bool)
+        removed[rows] = True
+        remap = np.arange(len(removed)) - np.cumsum(removed)
+        remap[rows] = -1
+        lists = [remap[list_rows] for list_rows in self._lists]
+        self._lists = [list_rows[list_rows >= 0] for list_rows in lists]
+
+    def candidates(self, probe) -> np.ndarray:
+        """
+        Generate the candidate rows of the gallery for a probe embedding
+        :param probe: the probe embedding
+        :return: the gallery row indices to re-score exactly, None if the whole gallery should be scanned
+        """
+        if self.centroids is None:
+            return None
+        vector = np.asarray(probe, dtype=np.float32)[None, :] * self.scale
+        lists = self._nearest_lists(vector, IVFIndex.n_probe)[0]
+        return np.sort(np.concatenate([self._lists[i] for i in lists]))
+
+    def evaluate(self, probes: np.ndarray = None):
+        """
+        Measure the recall of the exact best match in the candidate sets and the candidate generation latency
+        :param probes: probe embeddings, shape (m, dim). The gallery embeddings are used if not specified
+        :return: dictionary with the recall, the mean candidates fraction and the mean latency in milliseconds
+        """
+        matrix = self.gallery.embeddings()
+        if probes is None:
+            probes = matrix
+        hits, fraction, latency = 0, 0., 0.
+        for probe in probes:
+            exact = np.argmin(np.abs(matrix - probe) @ self.weights + self.bias)
+            start = time.perf_counter()
+            rows = self.candidates(probe)
+            latency += time.perf_counter() - start
+            if rows is None:
+                rows = np.arange(len(matrix))
+            hits += int(self.gallery.uids[exact] in self.gallery.uids[rows])
+            fraction += len(rows) / max(1, len(matrix))
+        m = max(1, len(probes))
+        return {'recall': hits / m, 'candidates': fraction / m, 'latency_ms': 1000 * latency / m}
@@ -1,4 +1,6 @@
 from camera_runner import Camera
+from image_process import Image
+from tracker import FaceTracker
 from user_login import User
 from utils.logger import Logger
 from utils.initialize import Init
@@ -13,14 +15,17 @@ def main():
 
         Init()
         Logger('\n' + msg.Info.barrier).log(msg_prefix=' ')
-        cam = Camera()
+        tracker = FaceTracker(lambda frame: Image.detect(frame, Image.detection_short_side), Image.conf_thresh,
+                              lambda: Init.ready('detector'))
+        cam = Camera(tracker if FaceTracker.enabled else None)
 
         while True:
             # activate and run the camera
             cam.run()
             Logger(msg.Info.barrier + '\n').log(msg_prefix='')
             user_img = cam.get_pic()
-            user = User(user_img)
+            claimed_uid = ui.ask_user_id() if User.ask_claimed_id else None
+            user = User(user_img, claimed_uid, cam.get_boxes())
 
             if user.valid:
                 # known person detected
@@ -28,11 +33,32 @@ def main():
                 Logger(msg.Info.user_login + f' {user.uid}', msg.Info).log()
 
                 ui.present_menu(user)
+            elif claimed_uid is not None:
+                # a failed verification is not an unknown person, only an identification miss may join the system
+                Logger(msg.Errors.verification_failed + f' - ID: {claimed_uid}', Logger.inform).log()
             else:
                 # unrecognized person detected
                 join = ui.continue_to_system()
                 if join:
-                    user.uid = Init.database.create_new_user(user)
+                    templates = []
+                    attempts = 0
+                    while len(templates) < User.enrollment_frames - 1:
+                        # capture more templates of the new user for steadier logins
+                        Logger(msg.Info.more_templates.format(len(templates) + 2, User.enrollment_frames),
+                               Logger.message).log()
+                        cam.run()
+                        attempts += 1
+                        try:
+                            templates.append(User.capture_template(cam.get_pic()))
+                        except Exception as e:
+                            Logger(e, Logger.inform).log()
+                            if attempts >= User.enrollment_attempts or not ui.retry_template():
+                                break
+                    if len(templates) < User.enrollment_frames - 1:
+                        # back to the login, the user was not added
+                        Logger(msg.Errors.enrollment_failed, Logger.inform).log()
+                        continue
+                    user.enroll(templates)  # the user is added only once all the templates are captured
                     Logger(msg.Info.user_login + f' {user.uid}', msg.Info).log()
                     ui.present_menu(user)
                 else:
@@ -40,7 +66,7 @@ def main():
     except Exception as e:
         Logger(e, level=Logger.inform).log(main)
     finally:
-        del Init.database
+        Init.close()
 
 
 if __name__ == '__main__':
@@ -79,7 +79,6 @@ def present_data(data: dict):
     :param data: a dictionary representing the user's data
     """
     data = data.copy()
-    del data['file']
     del data['user_id']
     data['file_state'] = ['locked' if state == Database.file_state_locked else 'open' for state in data['file_state']]
 
@@ -179,3 +178,35 @@ def continue_to_system() -> bool:
             return True
         elif ans == KeyMap.no:
             return False
+
+
+def retry_template() -> bool:
+    """
+    Ask the user to take another enrollment picture after a failed one
+    :return: True if the user wants to try again
+    """
+    Logger(msg.Requests.retry_template, level=Logger.message).log()
+    while True:
+        ans = input('>>> ')
+        if not ans.isalpha():
+            continue
+        ans = ans.lower()
+        if ans == KeyMap.yes:
+            return True
+        elif ans == KeyMap.no:
+            return False
+
+
+def ask_user_id():
+    """
+    Ask the user for a claimed user ID
+    :return: the claimed ID or None for identification
+    """
+    Logger(msg.Requests.claimed_uid, level=Logger.message).log()
+    while True:
+        ans = input('>>> ').strip()
+        if len(ans) == 0:
+            return None
+        if ans.isdigit():
+            return int(ans)
+        Logger(msg.Errors.invalid_uid, Logger.warning).log()
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# the application modules import from the repository root, and the model modules import their config directly
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, 'model')]
+
+
+@pytest.fixture
+def database_dir(tmp_path, monkeypatch):
+    """
+    Point the Database files to a temporary directory and replace the registry key of the DB encryption
+    :return: the directory
+    """
+    from cryptography.fernet import Fernet
+    from database import Database
+    from encryption import Encryption
+
+    key = Fernet.generate_key()
+    monkeypatch.setattr(Encryption, '_Encryption__retrieve_registry_key', staticmethod(lambda path, key_name: key))
+    monkeypatch.setattr(Database, 'parent_dir', str(tmp_path))
+    for name in ('org_path', 'locked_path', 'blobs_path', 'sidecar_matrix_path', 'sidecar_locked_path',
+                 'sidecar_index_path'):
+        monkeypatch.setattr(Database, name, str(tmp_path / os.path.basename(getattr(Database, name))))
+    return tmp_path
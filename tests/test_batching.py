@@ -0,0 +1,94 @@
+import threading
+import numpy as np
+import pytest
+
+from model.batching import BatchScheduler
+
+
+class FakeEngine:
+    """
+    Embeds a face as its first pixels and records the size of every batch
+    """
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    def embed(self, batch):
+        self.batches.append(len(batch))
+        if self.error is not None:
+            raise self.error
+        return np.asarray(batch).reshape(len(batch), -1)[:, :4].copy()
+
+
+def faces(value: float, n: int) -> np.ndarray:
+    return np.full((n, 1, 2, 2), value, dtype=np.float32)
+
+
+@pytest.fixture
+def wide_window(monkeypatch):
+    monkeypatch.setattr(BatchScheduler, 'window_ms', 200.)
+
+
+def test_requests_in_a_window_run_as_one_batch(wide_window):
+    engine = FakeEngine()
+    scheduler = BatchScheduler(engine)
+    futures = [scheduler.submit(faces(i, i)) for i in range(1, 5)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert engine.batches == [1 + 2 + 3 + 4]
+    for i, result in enumerate(results, start=1):  # every request gets its own faces back
+        np.testing.assert_array_equal(result, np.full((i, 4), i, dtype=np.float32))
+
+
+def test_concurrent_clients_share_batches(wide_window):
+    engine = FakeEngine()
+    scheduler = BatchScheduler(engine)
+    barrier = threading.Barrier(8)
+    results = [None] * 8
+
+    def client(i):
+        barrier.wait()
+        results[i] = scheduler.embed(faces(i, 1))
+
+    threads = [threading.Thread(target=client, args=(i, )) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert sum(engine.batches) == 8 and len(engine.batches) < 8
+    for i, result in enumerate(results):
+        np.testing.assert_array_equal(result, np.full((1, 4), i, dtype=np.float32))
+
+
+def test_max_batch_closes_the_window(wide_window, monkeypatch):
+    monkeypatch.setattr(BatchScheduler, 'max_batch', 4)
+    engine = FakeEngine()
+    scheduler = BatchScheduler(engine)
+    futures = [scheduler.submit(faces(i, 2)) for i in range(4)]
+    for future in futures:
+        future.result(timeout=5)
+    assert engine.batches == [4, 4]
+
+
+def test_engine_error_reaches_every_request(wide_window):
+    error = RuntimeError('engine failed')
+    scheduler = BatchScheduler(FakeEngine(error))
+    futures = [scheduler.submit(faces(i, 1)) for i in range(3)]
+    for future in futures:
+        assert future.exception(timeout=5) is error
+
+
+def test_metrics_count_batches_and_delays(wide_window):
+    scheduler = BatchScheduler(FakeEngine())
+    assert scheduler.metrics() == {'batches': 0, 'mean_batch': 0., 'mean_delay_ms': 0., 'max_delay_ms': 0.}
+    for future in [scheduler.submit(faces(i, 2)) for i in range(3)]:
+        future.result(timeout=5)
+    scheduler.embed(faces(9, 1))
+
+    metrics = scheduler.metrics()
+    assert metrics['batches'] == 2
+    assert metrics['mean_batch'] == pytest.approx(7 / 2)
+    # the first request of every batch waited for the whole window
+    assert metrics['max_delay_ms'] >= 0.9 * BatchScheduler.window_ms
+    assert 0 < metrics['mean_delay_ms'] <= metrics['max_delay_ms']
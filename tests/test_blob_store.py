@@ -0,0 +1,76 @@
+import os
+import time
+import hashlib
+import pytest
+
+from blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(BlobStore, 'chunk_size', 5)
+    return BlobStore(str(tmp_path / 'blobs'))
+
+
+def age(path, seconds=2 * BlobStore.collect_min_age):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_write_and_read_in_chunks(store):
+    data = [b'first chunk', b'', b'second chunk']
+    digest = store.write(data)
+    assert digest == hashlib.sha256(b''.join(data)).hexdigest()
+    assert store.path(digest).startswith(os.path.join(store.root, digest[:2], digest[2:4]))
+    chunks = list(store.read(digest))
+    assert b''.join(chunks) == b''.join(data) and max(map(len, chunks)) <= BlobStore.chunk_size
+
+
+def test_identical_contents_are_stored_once(store):
+    assert store.write([b'same']) == store.write([b'sa', b'me'])
+    assert sum(len(names) for _, _, names in os.walk(store.root)) == 1
+
+
+def test_failed_write_leaves_nothing(store):
+    def chunks():
+        yield b'partial'
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        store.write(chunks())
+    assert os.listdir(store.root) == []
+
+
+def test_collect_removes_old_unreferenced_files(store):
+    kept, dropped = store.write([b'kept']), store.write([b'dropped'])
+    leftover = os.path.join(store.root, BlobStore.temp_prefix + 'interrupted')
+    open(leftover, 'wb').close()
+    for path in (store.path(kept), store.path(dropped), leftover):
+        age(path)
+
+    assert store.collect({kept}) == 2
+    assert store.exists(kept) and not store.exists(dropped) and not os.path.exists(leftover)
+
+
+def test_collect_keeps_young_files(store):
+    fresh = store.write([b'not referenced yet'])
+    in_progress = os.path.join(store.root, BlobStore.temp_prefix + 'writing')
+    open(in_progress, 'wb').close()
+    assert store.collect(set()) == 0
+    assert store.exists(fresh) and os.path.exists(in_progress)
+
+
+def test_collect_skips_files_it_cannot_remove(store, monkeypatch):
+    locked, dropped = store.write([b'open elsewhere']), store.write([b'dropped'])
+    age(store.path(locked))
+    age(store.path(dropped))
+    remove = os.remove
+
+    def fake_remove(path):
+        if path == store.path(locked):
+            raise PermissionError(path)
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', fake_remove)
+    assert store.collect(set()) == 1
+    assert store.exists(locked) and not store.exists(dropped)
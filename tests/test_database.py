@@ -0,0 +1,284 @@
+import os
+import types
+import numpy as np
+import pytest
+
+from database import Database
+from model.SNN import Net
+
+
+def make_user(seed: int):
+    embedding = np.random.default_rng(seed).random(Net.embedding_size, dtype=np.float32)
+    return types.SimpleNamespace(embedding=embedding, uid=None,
+                                 img_data=types.SimpleNamespace(image=np.zeros((4, 4, 3), dtype=np.uint8)))
+
+
+@pytest.fixture
+def sidecar(database_dir, monkeypatch):
+    monkeypatch.setattr(Database, 'sidecar_dtype', 'float32')
+    return database_dir
+
+
+def test_sidecar_is_deleted_on_close_and_rebuilt(sidecar, monkeypatch):
+    db = Database()
+    user = make_user(0)
+    user.uid = db.create_new_user(user)
+    assert os.path.exists(Database.sidecar_matrix_path)
+    del db  # encrypts the DB back
+    for path in (Database.sidecar_matrix_path, Database.sidecar_index_path, Database.sidecar_locked_path):
+        assert not os.path.exists(path)     # no plaintext embeddings at rest
+
+    db = Database()
+    assert db.gallery.uids.tolist() == [user.uid]
+    assert np.array_equal(db.gallery.get(user.uid)[0], user.embedding)
+    del db  # encrypts the DB back
+
+
+def test_sidecar_left_by_an_interrupted_run_is_mapped(sidecar, monkeypatch):
+    db = Database()
+    user = make_user(0)
+    user.uid = db.create_new_user(user)
+    db.gallery.flush()
+    leftovers = {}
+    for path in (Database.sidecar_matrix_path, Database.sidecar_index_path):
+        with open(path, 'rb') as fd:
+            leftovers[path] = fd.read()
+    del db  # encrypts the DB back
+    for path, content in leftovers.items():     # the store files of a run which was not closed
+        with open(path, 'wb') as fd:
+            fd.write(content)
+
+    loads = []
+    monkeypatch.setattr(Database, '_Database__load_gallery', lambda self: loads.append(1))
+    db = Database()
+    assert loads == []
+    assert np.array_equal(db.gallery.get(user.uid)[0], user.embedding)
+    del db  # encrypts the DB back
+
+
+def test_sidecar_reloads_changed_embeddings_of_the_same_users(sidecar, monkeypatch):
+    db = Database()
+    first, second = make_user(0), make_user(1)
+    db.create_new_user(first)
+    uid = db.create_new_user(second)
+    del db  # encrypts the DB back
+
+    # the same user IDs with a re-enrolled embedding, changed while the sidecar was not in use
+    monkeypatch.setattr(Database, 'sidecar_dtype', None)
+    db = Database()
+    db.delete_user(uid, sure=True)
+    replaced = make_user(2)
+    assert db.create_new_user(replaced) == uid
+    del db  # encrypts the DB back
+
+    monkeypatch.setattr(Database, 'sidecar_dtype', 'float32')
+    db = Database()
+    assert np.array_equal(db.gallery.get(uid)[0], replaced.embedding)
+    del db  # encrypts the DB back
+
+
+def test_sidecar_of_an_old_version_is_rebuilt(sidecar):
+    db = Database()
+    user = make_user(0)
+    uid = db.create_new_user(user)
+    del db  # encrypts the DB back
+    with open(Database.sidecar_locked_path, 'wb') as fd:
+        fd.write(b'encrypted sidecar of an old version')
+    with open(Database.sidecar_matrix_path, 'wb') as fd:
+        fd.write(np.zeros((64, Net.embedding_size), dtype=np.float32).tobytes())
+    with open(Database.sidecar_index_path, 'wb') as fd:     # the old 2 fields header
+        fd.write(np.array([1, 4, uid] + [0] * 63, dtype=np.int64).tobytes())
+
+    db = Database()
+    assert not os.path.exists(Database.sidecar_locked_path)
+    assert np.array_equal(db.gallery.get(uid)[0], user.embedding)
+    del db  # encrypts the DB back
+
+
+def test_backup_is_restored_chunk_by_chunk(database_dir, monkeypatch):
+    from blob_store import BlobStore
+    from encryption import Encryption
+    monkeypatch.setattr(BlobStore, 'chunk_size', 7)     # several compressed and decompressed chunks
+    db = Database()
+    user = make_user(0)
+    user.uid = db.create_new_user(user)
+    key = db.get_user_embedding_as_key(user.uid)
+    content = os.urandom(1000) + b'\n' * 1000
+    blob_hash = db.blobs.write(Database._compress_data(Encryption.encrypt_data(content, key)))
+
+    path = str(database_dir / 'notes.txt')
+    with open(path, 'wb') as fd:
+        fd.write(b'overwritten')
+    db._recover(path, blob_hash, key, str(database_dir / 'notes.locked'))
+    with open(path, 'rb') as fd:
+        assert fd.read() == content
+    del db  # encrypts the DB back
+
+
+def test_deleting_a_user_collects_the_leftover_backups(database_dir):
+    from blob_store import BlobStore
+    db = Database()
+    user = make_user(0)
+    user.uid = db.create_new_user(user)
+    leftover = db.blobs.write([b'left by an interrupted operation'])
+    past = os.path.getmtime(db.blobs.path(leftover)) - 2 * BlobStore.collect_min_age
+    os.utime(db.blobs.path(leftover), (past, past))
+
+    del db  # encrypts the DB back
+    db = Database()
+    assert db.blobs.exists(leftover)    # not collected on start
+    assert db.delete_user(user.uid, sure=True)
+    assert not db.blobs.exists(leftover)
+    del db  # encrypts the DB back
+
+
+def legacy_database(version: int, *statements):
+    """
+    Create the unencrypted database of an older version
+    :param version: the schema version
+    :param statements: (SQL, parameters) pairs creating and filling the tables
+    """
+    import sqlite3
+    connection = sqlite3.connect(Database.org_path)
+    for statement, parameters in statements:
+        connection.execute(statement, parameters)
+    connection.execute(f"PRAGMA user_version = {version}")
+    connection.commit()
+    connection.close()
+
+
+def test_backups_are_moved_to_the_blob_store(database_dir):
+    import bz2
+    from encryption import Encryption
+    user = make_user(0)
+    embedding_b = Database._embedding_to_byte(user.embedding)
+    key = Encryption.key_from_embedding(Database.byte_to_embedding(embedding_b).tolist())
+    backup = bz2.compress(Encryption.encrypt_data(b'the file contents', key))
+    insert = "INSERT INTO files (path_key, file_path, suffix, uid, file, file_state) VALUES (?, ?, ?, ?, ?, ?)"
+    legacy_database(
+        2,
+        ("CREATE TABLE users(uid INTEGER PRIMARY KEY, user_embedding BLOB, user_image BLOB)", ()),
+        ("CREATE TABLE templates(tid INTEGER PRIMARY KEY, uid INTEGER, embedding BLOB)", ()),
+        ("CREATE TABLE files(path_key TEXT PRIMARY KEY, file_path TEXT, suffix TEXT, uid INTEGER, file TEXT, "
+         "file_state INTEGER)", ()),
+        ("INSERT INTO users (uid, user_embedding, user_image) VALUES (?, ?, ?)", (1, embedding_b, b'')),
+        (insert, (Database.path_key('C:\\docs\\a'), 'C:\\docs\\a', 'txt', 1, backup, Database.file_state_locked)),
+        (insert, (Database.path_key('C:\\docs\\b'), 'C:\\docs\\b', 'txt', 1, backup, Database.file_state_locked)),
+    )
+
+    db = Database()
+    db.cursor.execute("PRAGMA table_info(files)")
+    assert 'file' not in [row[1] for row in db.cursor.fetchall()]
+    db.cursor.execute("SELECT DISTINCT blob_hash FROM files")
+    (blob_hash, ), = db.cursor.fetchall()     # identical backups are stored once
+    assert b''.join(db.blobs.read(blob_hash)) == backup
+
+    path = str(database_dir / 'a.txt')
+    db._recover(path, blob_hash, db.get_user_embedding_as_key(1), str(database_dir / 'a.locked'))
+    with open(path, 'rb') as fd:
+        assert fd.read() == b'the file contents'
+    del db  # encrypts the DB back
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float32', 0), ('float16', 1e-3), ('uint8', 1e-2)])
+def test_embedding_header_round_trip(monkeypatch, dtype, tolerance):
+    monkeypatch.setattr(Database, 'embedding_dtype', dtype)
+    monkeypatch.setattr(Database, 'model_hash', b'12345678')
+    embedding = make_user(0).embedding
+    embedding_b = Database._embedding_to_byte(embedding)
+    magic, version, dtype_code, _, dim, model_hash = Database.embedding_header.unpack_from(embedding_b)
+    assert (magic, version, dtype_code) == (Database.embedding_magic, Database.embedding_version,
+                                            Database.embedding_dtypes[dtype])
+    assert (dim, model_hash) == (Net.embedding_size, b'12345678')
+
+    decoded = Database.byte_to_embedding(embedding_b)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, embedding, atol=tolerance, rtol=0)
+
+
+def test_unknown_embedding_format_is_rejected():
+    embedding_b = bytearray(Database._embedding_to_byte(make_user(0).embedding))
+    embedding_b[:4] = b'XXXX'
+    with pytest.raises(Exception):
+        Database.byte_to_embedding(bytes(embedding_b))
+
+
+def test_headerless_embeddings_are_migrated(database_dir, monkeypatch):
+    import struct
+    from encryption import Encryption
+    primary = make_user(0).embedding
+    template = make_user(1).embedding.astype(np.float16)
+    primary_b = struct.pack(f'{Net.embedding_size}f', *primary)     # the legacy float32 format
+    legacy_database(
+        0,
+        ("CREATE TABLE users(uid INTEGER PRIMARY KEY, user_embedding TEXT, user_image TEXT)", ()),
+        ("CREATE TABLE templates(tid INTEGER PRIMARY KEY, uid INTEGER, embedding TEXT)", ()),
+        ("INSERT INTO users (uid, user_embedding, user_image) VALUES (?, ?, ?)", (1, primary_b, b'')),
+        ("INSERT INTO templates (tid, uid, embedding) VALUES (?, ?, ?)", (1, 1, template.tobytes())),
+    )
+
+    monkeypatch.setattr(Database, 'model_hash', b'12345678')
+    db = Database()
+    db.cursor.execute("PRAGMA user_version")
+    assert db.cursor.fetchone()[0] == Database.schema_version
+    db.cursor.execute("SELECT user_embedding FROM users WHERE uid = 1")
+    assert db.cursor.fetchone()[0][Database.embedding_header.size:] == primary_b    # the payload is kept as it is
+
+    stored = db.fetch_user_embeddings(1)
+    assert np.array_equal(stored[0], primary)
+    assert np.array_equal(stored[1], template.astype(np.float32))
+    # the file keys are derived from the same values
+    legacy_values = list(struct.unpack(f'{Net.embedding_size}f', primary_b))
+    assert db.get_user_embedding_as_key(1) == Encryption.key_from_embedding(legacy_values)
+    assert db.count_foreign_embeddings() == 0   # the model of the migrated embeddings is unknown
+    del db  # encrypts the DB back
+
+
+def test_path_key_is_canonical():
+    assert Database.path_key('C:/Docs/Report') == Database.path_key('c:\\docs\\report')
+    assert Database.path_key('C:\\docs\\.\\sub\\..\\report') == Database.path_key('C:\\docs\\report')
+    assert Database.path_key('C:\\docs\\report') != Database.path_key('C:\\docs\\report2')
+
+
+def test_files_are_keyed_by_path_without_losing_rows(database_dir, capsys):
+    user = make_user(0)
+    insert = "INSERT INTO files (file_path, suffix, uid, file, file_state) VALUES (?, ?, ?, ?, ?)"
+    legacy_database(
+        1,
+        ("CREATE TABLE users(uid INTEGER PRIMARY KEY, user_embedding BLOB, user_image BLOB)", ()),
+        ("CREATE TABLE templates(tid INTEGER PRIMARY KEY, uid INTEGER, embedding BLOB)", ()),
+        ("CREATE TABLE files(file_path TEXT PRIMARY KEY, suffix TEXT, uid INTEGER, file TEXT, file_state INTEGER)",
+         ()),
+        ("INSERT INTO users (uid, user_embedding, user_image) VALUES (?, ?, ?)",
+         (1, Database._embedding_to_byte(user.embedding), b'')),
+        (insert, ('C:\\Docs\\Report', 'txt', 1, b'first', Database.file_state_locked)),
+        (insert, ('c:/docs/report', 'pdf', 1, b'same file', Database.file_state_locked)),
+        (insert, ('C:\\docs\\other', 'txt', 1, b'other', Database.file_state_locked)),
+    )
+
+    db = Database()
+    db.cursor.execute("SELECT path_key, file_path, suffix, blob_hash FROM files ORDER BY file_path")
+    rows = {row[1]: row for row in db.cursor.fetchall()}
+    assert len(rows) == 3   # no file is lost
+    key = Database.path_key('C:\\Docs\\Report')
+    assert rows['C:\\Docs\\Report'][:3] == (key, 'C:\\Docs\\Report', 'txt')
+    assert rows['c:/docs/report'][:3] == (f'{key}|pdf', 'c:/docs/report', 'pdf')  # the same Windows path
+    assert rows['C:\\docs\\other'][0] == Database.path_key('C:\\docs\\other')
+    assert b''.join(db.blobs.read(rows['C:\\Docs\\Report'][3])) == b'first'
+    assert b''.join(db.blobs.read(rows['c:/docs/report'][3])) == b'same file'
+    assert len(db.fetch_user_data(1)['file_path']) == 3
+    assert f'{key}|pdf' in capsys.readouterr().out    # the conflict is reported
+    db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'files'")
+    assert {'files_uid', 'files_state'} <= {row[0] for row in db.cursor.fetchall()}
+    del db  # encrypts the DB back
+
+
+def test_counting_foreign_embeddings_keeps_the_shared_cursor(database_dir, monkeypatch):
+    monkeypatch.setattr(Database, 'model_hash', b'model A.')
+    db = Database()
+    uids = [db.create_new_user(make_user(seed)) for seed in range(3)]
+    monkeypatch.setattr(Database, 'model_hash', b'model B.')
+    db.cursor.execute("SELECT uid FROM users ORDER BY uid")     # a query of the UI thread in progress
+    assert db.count_foreign_embeddings() == 3
+    assert [row[0] for row in db.cursor.fetchall()] == uids
+    del db  # encrypts the DB back
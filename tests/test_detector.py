@@ -0,0 +1,51 @@
+import sys
+import numpy as np
+import pytest
+
+from model.detector import FaceDetector, CascadeDetector
+
+
+class FixedDetector(FaceDetector):
+    def __init__(self, boxes, conf):
+        self.boxes, self.conf = np.asarray(boxes, dtype=np.float64).reshape(-1, 4), np.asarray(conf, dtype=np.float64)
+        self.calls = 0
+
+    def detect(self, image: np.ndarray):
+        self.calls += 1
+        return self.boxes, self.conf
+
+
+def test_import_does_not_load_mtcnn():
+    import model.detector
+    assert 'MTCNN' not in vars(model.detector)
+    assert 'facenet_pytorch' not in sys.modules
+
+
+def test_unknown_backend():
+    with pytest.raises(Exception, match='Unknown face detector: unknown'):
+        FaceDetector.create('unknown')
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        FaceDetector()
+
+
+def test_empty():
+    boxes, conf = FaceDetector.empty()
+    assert boxes.shape == (0, 4) and conf.shape == (0, )
+
+
+def test_cascade_keeps_confident_cheap_detections():
+    cheap, fallback = FixedDetector([[0, 0, 10, 10]], [0.95]), FixedDetector([[1, 1, 9, 9]], [0.99])
+    boxes, conf = CascadeDetector(cheap, fallback).detect(np.zeros((20, 20, 3), dtype=np.uint8))
+    assert fallback.calls == 0
+    assert boxes.tolist() == [[0, 0, 10, 10]]
+
+
+@pytest.mark.parametrize('cheap_boxes, cheap_conf', [([], []), ([[0, 0, 10, 10]], [0.5])])
+def test_cascade_falls_back_when_unsure(cheap_boxes, cheap_conf):
+    cheap, fallback = FixedDetector(cheap_boxes, cheap_conf), FixedDetector([[1, 1, 9, 9]], [0.99])
+    boxes, conf = CascadeDetector(cheap, fallback).detect(np.zeros((20, 20, 3), dtype=np.uint8))
+    assert fallback.calls == 1
+    assert boxes.tolist() == [[1, 1, 9, 9]]
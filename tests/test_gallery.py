@@ -0,0 +1,39 @@
+import numpy as np
+
+from gallery import Gallery
+
+
+def synthetic_gallery(dim: int = 64, users: int = 40):
+    rng = np.random.default_rng(5)
+    centers = rng.random((users, dim), dtype=np.float32)
+    matrix = np.clip(np.repeat(centers, 2, axis=0) + rng.normal(0, 0.01, (2 * users, dim)), 0, 1)
+    gallery = Gallery(dim)
+    gallery.load(np.repeat(np.arange(users), 2), matrix.astype(np.float32))
+    weights = rng.random(dim) / dim
+    return gallery, weights
+
+
+def test_quantization_report_on_a_synthetic_gallery():
+    gallery, weights = synthetic_gallery()
+    report = gallery.quantization_report(weights, 0., 0.05)
+
+    assert set(report) == {'float32', 'float16', 'uint8'}
+    assert report['float32']['changed'] == 0 and report['float32']['max_error'] == 0
+    assert report['float16']['changed'] == 0
+    assert report['float16']['max_error'] < 1e-3
+    assert report['uint8']['max_error'] < 1e-2
+    assert report['uint8']['bytes'] < report['float16']['bytes'] < report['float32']['bytes']
+
+
+def test_quantization_report_with_probes():
+    gallery, weights = synthetic_gallery()
+    probes = gallery.embeddings()[::2] + 0.001
+    report = gallery.quantization_report(weights, 0., 0.05, probes)
+    assert report['float16']['changed'] == 0
+
+
+def test_uint8_round_trip():
+    matrix = np.random.default_rng(0).random((10, 32), dtype=np.float32)
+    quantized, scales = Gallery.quantize(matrix)
+    assert quantized.dtype == np.uint8
+    np.testing.assert_allclose(Gallery.dequantize(quantized, scales), matrix, atol=scales.max() / 2 + 1e-7)
@@ -0,0 +1,67 @@
+import glob
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import cv2 as cv
+import numpy as np
+import pytest
+
+from model.preprocess import FacePreprocessor
+
+images_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+
+
+def boxes_of(frame):
+    h, w = frame.shape[:2]
+    return [(0, 0, w, h), (w // 6, h // 5, w // 2, 4 * h // 5), (w // 3, h // 8, w - w // 8, h // 2),
+            (-10, -10, w // 4, h // 3)]
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(images_dir, '*.png'))))
+def test_parity_with_the_original_pipeline(path):
+    frame = cv.imread(path)
+    boxes = boxes_of(frame)
+    batch = FacePreprocessor()(frame, boxes)
+    for face, box in zip(batch, boxes):
+        reference = FacePreprocessor.reference(frame, box)
+        assert face.shape == reference.shape
+        assert np.abs(face - reference).max() <= FacePreprocessor.parity_tolerance
+
+
+def test_check_parity_passes():
+    frame = cv.imread(os.path.join(images_dir, 'example1.png'))
+    report = FacePreprocessor().check_parity(frame, boxes_of(frame))
+    assert report['passed']
+    assert report['max_error'] <= FacePreprocessor.parity_tolerance
+
+
+def test_batches_do_not_share_memory():
+    frame = cv.imread(os.path.join(images_dir, 'example1.png'))
+    preprocessor = FacePreprocessor()
+    first = preprocessor(frame, boxes_of(frame)[:1])
+    kept = first.copy()
+    preprocessor(frame, boxes_of(frame)[1:2])
+    assert np.array_equal(first, kept)
+
+
+def test_concurrent_threads():
+    frame = cv.imread(os.path.join(images_dir, 'example1.png'))
+    boxes = boxes_of(frame)
+    preprocessor = FacePreprocessor()
+    expected = [preprocessor(frame, [box]) for box in boxes]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda i: preprocessor(frame, [boxes[i % len(boxes)]]), range(64)))
+    for i, result in enumerate(results):
+        assert np.array_equal(result, expected[i % len(boxes)])
+
+
+def test_onnx_backend_does_not_load_torch():
+    root = os.path.dirname(images_dir)
+    script = (f'import sys; sys.path[:0] = [{root!r}, {os.path.join(root, "model")!r}]\n'
+              'import model.config as config\n'
+              'config.INFERENCE_BACKEND = "onnx"\n'
+              'import user_login\n'
+              'print(sorted({"torch", "torchvision", "model.inference", "model.dataset"} & set(sys.modules)))')
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
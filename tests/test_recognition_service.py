@@ -0,0 +1,119 @@
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from recognition_service import RecognitionServer, RecognitionClient, RemoteDetector, RemoteEngine
+
+
+class FakeDetector:
+    def __init__(self):
+        self.calls = 0
+
+    def detect(self, image):
+        self.calls += 1
+        return np.array([[0., 0., 10., 10.]]), np.array([0.99])
+
+
+class FakeEngine:
+    weights = np.arange(4, dtype=np.float32)
+    bias = 0.5
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, batch):
+        self.calls += 1
+        return np.asarray(batch, dtype=np.float32).reshape(len(batch), -1)[:, :4] * 2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(RecognitionServer, 'address', ('localhost', free_port()))
+    monkeypatch.setattr(RecognitionServer, 'key_path', str(tmp_path / 'service.key'))
+    server = RecognitionServer(FakeDetector(), FakeEngine())
+    threading.Thread(target=server.serve, daemon=True).start()
+    wait_for(lambda: os.path.exists(RecognitionServer.key_path))
+    return server
+
+
+def test_requests_are_served(service):
+    client = RecognitionClient.connect()
+    assert client is not None
+    boxes, conf = RemoteDetector(client, FakeDetector).detect(np.zeros((8, 8, 3), dtype=np.uint8))
+    assert boxes.shape == (1, 4) and conf[0] == pytest.approx(0.99)
+
+    engine = RemoteEngine(client, FakeEngine)
+    np.testing.assert_array_equal(engine.weights, FakeEngine.weights)
+    assert engine.bias == FakeEngine.bias
+    batch = np.ones((3, 1, 2, 2), dtype=np.float32)
+    np.testing.assert_array_equal(engine.embed(batch), np.full((3, 4), 2., dtype=np.float32))
+    assert service.engine.calls == 1 and engine.local is None
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX file modes')
+def test_key_file_is_private(service):
+    assert stat.S_IMODE(os.stat(RecognitionServer.key_path).st_mode) == 0o600
+
+
+def test_second_instance_keeps_the_key(service):
+    key = RecognitionServer.read_key()
+    with pytest.raises(OSError):
+        RecognitionServer(FakeDetector(), FakeEngine()).serve()
+    assert RecognitionServer.read_key() == key
+    assert RecognitionClient.connect() is not None
+
+
+def test_wrong_key_is_not_connected(service):
+    with open(RecognitionServer.key_path, 'wb') as key_file:
+        key_file.write(b'not the key')
+    assert RecognitionClient.connect() is None
+
+
+def test_no_service(tmp_path, monkeypatch):
+    monkeypatch.setattr(RecognitionServer, 'key_path', str(tmp_path / 'service.key'))
+    assert RecognitionClient.connect() is None
+
+
+def test_reconnect_after_lost_connection(service):
+    client = RecognitionClient.connect()
+    client._connection.close()
+    boxes, _ = client.request('detect', np.zeros((8, 8, 3), dtype=np.uint8))
+    assert len(boxes) == 1
+
+
+def test_fallback_when_service_is_lost(service, monkeypatch):
+    client = RecognitionClient.connect()
+    detector = RemoteDetector(client, FakeDetector)
+    engine = RemoteEngine(client, FakeEngine)
+    client._connection.close()
+    monkeypatch.setattr(RecognitionServer, 'address', ('localhost', free_port()))     # nothing listens there
+
+    boxes, _ = detector.detect(np.zeros((8, 8, 3), dtype=np.uint8))
+    assert len(boxes) == 1 and detector.local.calls == 1
+    engine.embed(np.ones((2, 1, 2, 2), dtype=np.float32))
+    assert engine.local.calls == 1 and service.engine.calls == 0
+
+
+def test_service_error_is_not_a_lost_service(service):
+    client = RecognitionClient.connect()
+    with pytest.raises(RuntimeError):
+        client.request('unknown')
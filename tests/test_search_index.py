@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from gallery import Gallery
+from search_index import IVFIndex
+
+DIM = 16
+
+
+@pytest.fixture
+def indexed():
+    rng = np.random.default_rng(1)
+    centers = rng.random((20, DIM))
+    matrix = np.clip(centers[rng.integers(0, 20, 600)] + rng.normal(0, 0.02, (600, DIM)), 0, 1)
+    gallery = Gallery(DIM)
+    gallery.load(np.arange(600) // 2, matrix.astype(np.float32))    # two rows per user
+    index = IVFIndex(rng.random(DIM))
+    index.attach(gallery)
+    return gallery, index
+
+
+def check_lists(gallery, index):
+    rows = np.sort(np.concatenate(index._lists))
+    np.testing.assert_array_equal(rows, np.arange(len(gallery)))
+
+
+def test_small_gallery_is_scanned_exactly():
+    gallery = Gallery(DIM)
+    gallery.load(np.arange(10), np.random.default_rng(0).random((10, DIM), dtype=np.float32))
+    index = IVFIndex(np.ones(DIM))
+    index.attach(gallery)
+    assert index.candidates(gallery.embeddings()[0]) is None
+
+
+def test_candidates_are_sorted_rows_with_the_exact_match(indexed):
+    gallery, index = indexed
+    check_lists(gallery, index)
+    probe = gallery.embeddings()[123]
+    rows = index.candidates(probe)
+    assert 123 in rows and len(rows) < len(gallery)
+    assert np.all(np.diff(rows) > 0)
+    assert index.evaluate()['recall'] > 0.95
+
+
+def test_add_appends_the_new_row(indexed):
+    gallery, index = indexed
+    embedding = gallery.embeddings()[7] + 0.001
+    gallery.add(1000, embedding)
+    check_lists(gallery, index)
+    assert len(gallery) - 1 in index.candidates(embedding)
+
+
+def test_remove_remaps_the_rows(indexed):
+    gallery, index = indexed
+    kept = gallery.embeddings()[501].copy()
+    gallery.remove(100)     # rows 200 and 201
+    check_lists(gallery, index)
+    assert 100 not in gallery.uids[index.candidates(gallery.embeddings()[200])]
+    np.testing.assert_array_equal(gallery.embeddings()[499], kept)
+    assert 499 in index.candidates(kept)
+    assert index.evaluate()['recall'] > 0.95
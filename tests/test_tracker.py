@@ -0,0 +1,71 @@
+import threading
+import time
+import numpy as np
+
+from tracker import FaceTracker
+
+
+def make_frame(x: int, y: int, size: int = 40) -> np.ndarray:
+    """
+    A noisy frame with a textured square "face" at (x, y)
+    """
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 30, (240, 320, 3), dtype=np.uint8)
+    frame[y: y + size, x: x + size] = np.random.default_rng(1).integers(100, 255, (size, size, 3), dtype=np.uint8)
+    return frame
+
+
+def wait_for(tracker: FaceTracker, timeout: float = 2.):
+    deadline = time.perf_counter() + timeout
+    while tracker._pending is not None and not tracker._pending.done() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+
+
+def test_disabled_by_default():
+    assert FaceTracker.enabled is False
+
+
+def test_update_does_not_wait_for_the_detector():
+    release = threading.Event()
+
+    def slow_detect(frame):
+        release.wait(2)
+        return np.array([[50, 60, 90, 100]]), np.array([0.99])
+
+    tracker = FaceTracker(slow_detect)
+    start = time.perf_counter()
+    assert tracker.update(make_frame(50, 60)) == []
+    assert time.perf_counter() - start < 0.5
+    release.set()
+    wait_for(tracker)
+    assert tracker.update(make_frame(50, 60)) == [(50, 60, 90, 100)]
+
+
+def test_detection_is_followed_to_the_current_frame():
+    tracker = FaceTracker(lambda frame: (np.array([[50, 60, 90, 100]]), np.array([0.99])))
+    tracker.update(make_frame(50, 60))
+    wait_for(tracker)
+    assert tracker.update(make_frame(56, 64)) == [(56, 64, 96, 104)]
+    assert tracker.confident_boxes() == [(56, 64, 96, 104)]
+
+
+def test_idle_detection_runs_every_detect_every_frames():
+    calls = []
+
+    def detect(frame):
+        calls.append(1)
+        return np.empty((0, 4)), np.empty(0)
+
+    tracker = FaceTracker(detect)
+    for _ in range(3 * FaceTracker.detect_every):
+        tracker.update(make_frame(50, 60))
+        wait_for(tracker)
+    assert len(calls) == 3
+    assert tracker.confident_boxes() is None
+
+
+def test_low_confidence_detections_are_dropped():
+    tracker = FaceTracker(lambda frame: (np.array([[50, 60, 90, 100]]), np.array([0.5])), conf_thresh=0.9)
+    tracker.update(make_frame(50, 60))
+    wait_for(tracker)
+    assert tracker.update(make_frame(50, 60)) == []
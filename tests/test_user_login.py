@@ -0,0 +1,114 @@
+from concurrent.futures import Future
+import types
+import numpy as np
+import pytest
+
+import user_login
+from gallery import Gallery
+from user_login import User
+from utils.initialize import Init
+from model.SNN import Net
+
+
+def ready(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+@pytest.fixture
+def components(monkeypatch):
+    """
+    Provide the Init objects to the tested User objects
+    :return: a function setting an Init object by name
+    """
+    futures = {}
+    monkeypatch.setattr(Init, 'futures', futures)
+    return lambda name, value: futures.__setitem__(name, ready(value))
+
+
+def make_user(embedding) -> User:
+    user = User.__new__(User)
+    user.embedding = np.asarray(embedding, dtype=np.float32)
+    user.img_data = types.SimpleNamespace(image=np.zeros((4, 4, 3), dtype=np.uint8))
+    user.uid, user.score, user.top_k, user.cascade_stats = None, None, [], []
+    return user
+
+
+@pytest.mark.parametrize('faces', [0, 2])
+def test_capture_template_needs_a_single_face(monkeypatch, faces):
+    fake = types.SimpleNamespace(embeddings_dict={(i, i, i + 1, i + 1): np.zeros(4) for i in range(faces)})
+    monkeypatch.setattr(user_login, 'Image', lambda frame: fake)
+    with pytest.raises(ValueError):
+        User.capture_template(np.zeros((4, 4, 3), dtype=np.uint8))
+
+
+def test_enroll_adds_the_user_with_all_templates(database_dir, components):
+    from database import Database
+    db = Database()
+    components('database', db)
+    rng = np.random.default_rng(0)
+    user = make_user(rng.random(Net.embedding_size))
+    templates = [rng.random(Net.embedding_size, dtype=np.float32) for _ in range(2)]
+    user.enroll(templates)
+
+    assert db.fetch_all_ids() == [(user.uid, )]
+    stored = db.fetch_user_embeddings(user.uid)
+    assert np.array_equal(stored, np.stack([user.embedding, *templates]))
+    del db
+
+
+class FakeEngine:
+    """
+    The SNN head - a weighted L1 distance
+    """
+
+    def __init__(self, weights, bias=0.):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = bias
+
+    def score(self, embedding, matrix):
+        return np.abs(matrix - embedding) @ self.weights + self.bias
+
+
+@pytest.fixture
+def cascade_gallery(components, monkeypatch):
+    dim = 32
+    rng = np.random.default_rng(3)
+    weights = rng.random(dim)
+    weights[:4] *= -0.1
+    gallery = Gallery(dim)
+    gallery.load(np.arange(200) // 2, rng.random((200, dim), dtype=np.float32))
+    components('engine', FakeEngine(weights, 0.1))
+    components('database', types.SimpleNamespace(gallery=gallery))
+    components('reduced', None)
+    monkeypatch.setattr(User, 'use_index', False)
+    monkeypatch.setattr(User, 'cascade_stages', (4, 12, 24))
+    monkeypatch.setattr(User, 'dist_thresh', 0.5)
+    return gallery, rng
+
+
+def test_cascade_decides_as_the_exact_scan(cascade_gallery):
+    gallery, rng = cascade_gallery
+    probes = np.concatenate([gallery.embeddings()[::7] + rng.normal(0, 0.01, (29, gallery.dim)),
+                             rng.random((20, gallery.dim))]).astype(np.float32)
+    matched = 0
+    for probe in probes:
+        exact = make_user(probe)
+        expected = exact.check_similarity(gallery)
+        user = make_user(probe)
+        assert user.login() == (expected is not None)
+        assert user.uid == expected
+        if expected is not None:
+            matched += 1
+            assert user.score == pytest.approx(exact.score, abs=1e-5)
+            assert user.cascade_stats and sum(pruned for _, _, pruned in user.cascade_stats) > 0
+    assert 0 < matched < len(probes)
+
+
+def test_all_pruned_reports_no_match(cascade_gallery, monkeypatch):
+    gallery, rng = cascade_gallery
+    monkeypatch.setattr(User, 'dist_thresh', -1.)
+    user = make_user(gallery.embeddings()[0])
+    assert not user.login()
+    assert user.uid is None and user.score == np.inf and user.top_k == []
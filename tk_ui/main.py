@@ -13,7 +13,7 @@ def main():
     except Exception as e:
         Logger(e, level=Logger.inform).log()
     finally:
-        del Init.database
+        Init.close()
 
 
 if __name__ == "__main__":
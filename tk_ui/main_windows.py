@@ -9,6 +9,8 @@ import cv2
 
 from utils.initialize import Init
 from user_login import User
+from image_process import Image as Frame
+from tracker import FaceTracker
 from utils.logger import Logger
 from utils.messages import Messages as msg
 from tk_ui.ui import Window
@@ -43,13 +45,26 @@ class LoginWindow(tk.Frame, Init, Window):
         self.retake_button = ttk.Button(self.button_frame, text="Retake", command=self.retake, state=tk.DISABLED)
         self.retake_button.pack(side=tk.LEFT, padx=5)
 
+        # optional user ID for 1:1 verification instead of identification
+        self.uid_frame = tk.Frame(self)
+        self.uid_frame.pack()
+        self.uid_label = tk.Label(self.uid_frame, text="User ID (optional)")
+        self.uid_label.pack(side=tk.LEFT, padx=5)
+        self.uid_entry = ttk.Entry(self.uid_frame, width=10)
+        self.uid_entry.pack(side=tk.LEFT)
+
         self.login_button = ttk.Button(self, text="Login", command=self.login, state=tk.DISABLED)
         self.login_button.pack(pady=5)
 
         self.camera = cv2.VideoCapture(0)
         self.captured = False
         self.captured_image = None
+        self.captured_boxes = None
         self.user = None
+        self.tracker = None
+        if FaceTracker.enabled:
+            self.tracker = FaceTracker(lambda frame: Frame.detect(frame, Frame.detection_short_side),
+                                       Frame.conf_thresh, lambda: Init.ready('detector'))
 
         self.update_camera()  # Start updating the camera view
 
@@ -61,6 +76,8 @@ class LoginWindow(tk.Frame, Init, Window):
         Update the camera every 10 milliseconds until image capture
         """
         _, frame = self.camera.read()
+        if self.tracker is not None:
+            self.tracker.update(frame)
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         rgb_frame = cv2.flip(rgb_frame, 1)
         image = ImageTk.PhotoImage(Image.fromarray(rgb_frame))
@@ -81,6 +98,10 @@ class LoginWindow(tk.Frame, Init, Window):
         _, frame = self.camera.read()
         self.captured_image = frame
         self.image_dims = self.captured_image.shape
+        if self.tracker is not None:
+            # follow the faces to the captured frame so the login can skip the detection
+            self.tracker.update(frame)
+            self.captured_boxes = self.tracker.confident_boxes()
 
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         rgb_frame = cv2.flip(rgb_frame, 1)
@@ -104,29 +125,75 @@ class LoginWindow(tk.Frame, Init, Window):
         Try to log in the user. If successful - continues to the application's UI
         """
         if self.captured:
+            claimed_uid = self.uid_entry.get().strip()
+            if len(claimed_uid) != 0 and not claimed_uid.isdigit():
+                messagebox.showerror("Login Failed", msg.Errors.invalid_uid)
+                return
+            claimed_uid = int(claimed_uid) if claimed_uid else None
+
             # Perform face verification using the captured image
-            self.user = User(self.captured_image)
-            switch_win = False
+            self.user = User(self.captured_image, claimed_uid, self.captured_boxes)
 
             if self.user.valid:
                 # known person detected
                 Logger('Access Granted', Logger.info).log()
                 Logger(msg.Info.user_login + f' {self.user.uid}', msg.Info).log()
-                switch_win = True
+                self.enter()
+            elif claimed_uid is not None:
+                # a failed verification is not an unknown person, only an identification miss may join the system
+                messagebox.showerror("Login Failed", msg.Errors.verification_failed + f' - ID: {claimed_uid}')
+                self.user = None
             else:
                 # Prompt user to join the system with a popup window
                 join = messagebox.askyesno("Login Failed", "Login failed. Would you like to join the system?")
                 if join:
-                    self.user.uid = self.database.create_new_user(self.user)
-                    Logger(msg.Info.user_login + f' {self.user.uid}', msg.Info).log()
-                    switch_win = True
+                    self.enroll_templates()
                 else:
                     self.user = None
 
-            if switch_win:
-                image = self.database.get_user_image(self.user.uid, self.image_dims, convert_rgb=True)
-                self.show_image_message(image, self.user.uid)
-                self.root.switch_frame(MainWindow(self.root, self.get_window_size(), self.user))
+    def enter(self):
+        """
+        Continue to the application's UI with the logged-in user
+        """
+        image = self.database.get_user_image(self.user.uid, self.image_dims, convert_rgb=True)
+        self.show_image_message(image, self.user.uid)
+        self.root.switch_frame(MainWindow(self.root, self.get_window_size(), self.user))
+
+    def enroll_templates(self):
+        """
+        Capture more frames of the new user from the camera as additional templates, scheduled on the Tk event loop
+        so the window keeps responding. The user joins the system once all the templates are captured
+        """
+        messagebox.showinfo("Enrollment", msg.Info.templates_capture)
+        self.login_button.configure(state=tk.DISABLED)
+        self.retake_button.configure(state=tk.DISABLED)
+        self.capture_button.configure(state=tk.DISABLED)    # re-enabled by retake if the enrollment fails
+        self.after(int(User.enrollment_interval * 1000), self.capture_template, [], 0)
+
+    def capture_template(self, templates: list, attempts: int):
+        """
+        Capture a single enrollment template and schedule the next one
+        :param templates: the templates captured so far
+        :param attempts: the number of frames tried so far
+        """
+        _, frame = self.camera.read()
+        try:
+            templates.append(User.capture_template(frame))
+        except Exception as e:
+            Logger(e, Logger.inform).log()
+        attempts += 1
+
+        if len(templates) == User.enrollment_frames - 1:
+            self.user.enroll(templates)
+            Logger(msg.Info.user_login + f' {self.user.uid}', msg.Info).log()
+            self.enter()
+        elif attempts >= User.enrollment_attempts:
+            messagebox.showerror("Enrollment Failed", msg.Errors.enrollment_failed)
+            self.user = None
+            self.retake()
+        else:
+            # let the pose change a little between the templates
+            self.after(int(User.enrollment_interval * 1000), self.capture_template, templates, attempts)
 
     def destroy(self):
         """
@@ -382,7 +449,6 @@ class MainWindow(tk.Frame, Init, Window):
         """
         data = data.copy()
 
-        del data['file']
         del data['user_id']
         data['file_state'] = ['locked' if state == Database.file_state_locked else 'open' for state in
                               data['file_state']]
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+
+
+class FaceTracker:
+    """
+    Track the faces of a live camera stream. The detector runs every detect_every frames and the faces are followed
+    in between by matching the detected face patches around their last position, so the face boxes are already known
+    when a frame is captured.
+    The detections run in a background worker so the preview (and the UI thread calling update) never waits for the
+    detector - a finished detection is picked up by the next update and followed to the current frame.
+    """
+    enabled = False
+    detect_every = 10       # number of frames between detections
+    search_margin = 0.5     # the search window around the last box, as a fraction of the box size
+    lost_confidence = 0.5   # a face whose match score drops below this is dropped until the next detection
+    trust_confidence = 0.8  # the boxes are used instead of running the detector only above this match score
+
+    def __init__(self, detect, conf_thresh: float = 0.9, ready=None):
+        """
+        :param detect: a function from a frame to the face bounding boxes and their confidences
+        :param conf_thresh: the minimal detection confidence of a tracked face
+        :param ready: a function telling if the detector is ready, the frames are not tracked until it is
+        """
+        self.detect = detect
+        self.conf_thresh = conf_thresh
+        self.ready = ready
+        self.boxes = []
+        self.confidence = []
+        self._templates = []
+        self._frames = 0
+        self._pending = None    # the future of the running detection
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tracker')
+
+    def reset(self):
+        """
+        Forget the tracked faces, the next frame starts a detection
+        """
+        self.boxes, self.confidence, self._templates = [], [], []
+        self._frames = 0
+        self._pending = None    # a running detection is of an older stream, its result is dropped
+
+    def update(self, frame: np.ndarray):
+        """
+        Follow the faces to a new frame, without waiting for the detector
+        :param frame: the camera frame (BGR)
+        :return: the face bounding boxes in format (x1, y1, x2, y2)
+        """
+        if self.ready is not None and not self.ready():
+            return self.boxes
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        if self._pending is not None and self._pending.done():
+            pending, self._pending = self._pending, None
+            if pending.exception() is None:
+                self.boxes, self.confidence, self._templates = pending.result()
+        if len(self.boxes) != 0:
+            self._track(gray)
+        if self._frames % FaceTracker.detect_every == 0 and self._pending is None:
+            self._pending = self._worker.submit(self._detect, frame.copy())
+        self._frames += 1
+        return self.boxes
+
+    def confident_boxes(self):
+        """
+        :return: the tracked face bounding boxes if every face is followed confidently, None otherwise
+        """
+        if len(self.boxes) == 0 or min(self.confidence) < FaceTracker.trust_confidence:
+            return None
+        return list(self.boxes)
+
+    def _detect(self, frame: np.ndarray):
+        """
+        Run the detector (in the worker) and cut the patches of the detected faces as the tracking templates
+        :param frame: the camera frame (BGR)
+        :return: the face boxes, their confidences and their templates
+        """
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        detections, conf = self.detect(frame)
+        boxes, confidence, templates = [], [], []
+        for box, c in zip(detections, conf):
+            if c < self.conf_thresh:
+                continue
+            x1, y1, x2, y2 = (int(v) for v in box)
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            boxes.append((x1, y1, x2, y2))
+            confidence.append(1.)
+            templates.append(gray[y1: y2, x1: x2].copy())
+        return boxes, confidence, templates
+
+    def _track(self, gray: np.ndarray):
+        """
+        Move every box to the best match of its template in a window around its last position
+        """
+        h, w = gray.shape
+        boxes, confidence, templates = [], [], []
+        for (x1, y1, x2, y2), template in zip(self.boxes, self._templates):
+            mx, my = int((x2 - x1) * FaceTracker.search_margin), int((y2 - y1) * FaceTracker.search_margin)
+            sx1, sy1, sx2, sy2 = max(0, x1 - mx), max(0, y1 - my), min(w, x2 + mx), min(h, y2 + my)
+            th, tw = template.shape
+            if sx2 - sx1 < tw or sy2 - sy1 < th:
+                continue
+            result = cv.matchTemplate(gray[sy1: sy2, sx1: sx2], template, cv.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv.minMaxLoc(result)
+            if score < FaceTracker.lost_confidence:
+                continue
+            boxes.append((sx1 + dx, sy1 + dy, sx1 + dx + tw, sy1 + dy + th))
+            confidence.append(float(score))
+            templates.append(template)
+        self.boxes, self.confidence, self._templates = boxes, confidence, templates
@@ -1,8 +1,8 @@
-import torch
 import numpy as np
 import sys
 
 from image_process import Image
+from gallery import Gallery
 from utils.initialize import Init
 from utils.logger import Logger
 from utils.messages import Messages as msg
@@ -13,46 +13,184 @@ class User(Init):
     The class represents user object
     """
     dist_thresh = 0.5
+    use_index = True    # generate candidates with the gallery search index before exact scoring
+    cascade_stages = (128, 1024)    # prefixes of the highest weight dimensions scored before pruning, None disables
+    cascade_margin = 1e-4   # tolerance for the different summation order of the partial scores
+    aggregation = 'min'     # how the scores of a user's templates are combined - 'min', 'mean' or 'centroid'
+    enrollment_frames = 3   # number of frames captured as templates when a user joins
+    enrollment_interval = 0.5   # seconds between the frames captured automatically for the enrollment
+    enrollment_attempts = 10    # frames the UIs try before giving up the enrollment
+    ask_claimed_id = False  # ask for a user ID to verify against (1:1) at the terminal login, instead of identifying
 
-    def __init__(self, user_img):
+    def __init__(self, user_img, claimed_uid: int = None, boxes=None):
+        """
+        :param user_img: the captured frame
+        :param claimed_uid: the ID the user claims to have - verify against it instead of identifying in the gallery
+        :param boxes: the face bounding boxes of the frame if already known (e.g. tracked), skips the face detection
+        """
         super().__init__()
-        self.img_data = Image(user_img)
+        self.img_data = Image(user_img, boxes)
         self.embedding = self.img_data.choose_face()
         self.uid = None
 
         self.score = sys.maxsize
-        self.valid = self.login()
+        self.top_k = []
+        self.cascade_stats = []
+        self.valid = self.login() if claimed_uid is None else self.verify(claimed_uid)
+
+    def identify(self, gallery, rows: np.ndarray = None, top_k: int = 1):
+        """
+        Score the user's embedding against the gallery with batched evaluations of the SNN head and aggregate the
+        scores of every user's templates.
+        Compressed galleries are scored block by block directly from the stored matrix
+        :param gallery: a Gallery object
+        :param rows: the gallery rows to score, all rows if not specified
+        :param top_k: number of best matching users to return
+        :return: the best matching ID, its score and the top-k matches as [(ID, score) ...]
+        """
+        uids = gallery.uids if rows is None else gallery.uids[rows]
+        if len(uids) == 0:
+            return None, sys.maxsize, []
+
+        users, inverse = np.unique(uids, return_inverse=True)
+        if User.aggregation == 'centroid':
+            centroids = np.zeros((len(users), gallery.dim), dtype=np.float32)
+            np.add.at(centroids, inverse, gallery.embeddings(rows))
+            centroids /= np.bincount(inverse)[:, None]
+            scores = self.engine.score(self.embedding, centroids)
+        else:
+            row_scores = np.concatenate([self.engine.score(self.embedding, block) for block in gallery.blocks(rows)])
+            if User.aggregation == 'mean':
+                scores = np.bincount(inverse, weights=row_scores) / np.bincount(inverse)
+            else:
+                scores = np.full(len(users), np.inf, dtype=row_scores.dtype)
+                np.minimum.at(scores, inverse, row_scores)
+
+        k = min(top_k, len(scores))
+        if k == 1:
+            best = [np.argmin(scores)]
+        else:
+            best = np.argpartition(scores, k - 1)[:k]
+            best = best[np.argsort(scores[best], kind='stable')]
+        top = [(int(users[i]), float(scores[i])) for i in best]
+        return top[0][0], top[0][1], top
 
-    def check_similarity(self, data: list):
+    def check_similarity(self, gallery, rows: np.ndarray = None, top_k: int = 1):
         """
         Get the user ID
-        :param data: data as [(ID, embedding) ...]
+        :param gallery: a Gallery object
+        :param rows: the gallery rows to score, all rows if not specified
+        :param top_k: number of best matches to keep in self.top_k
         :return: the ID of the user if in the DB else None
         """
-        min_dist = 100
-        identity = None
-
-        dist = 0
-        for uid, e, _ in data:
-            e = torch.from_numpy(np.array(list(e))).to(torch.float32)
-            dist = self.net.forward_embeddings(e, self.embedding).item()
-            if dist < min_dist:
-                min_dist = dist
-                identity = uid
+        identity, min_dist, self.top_k = self.identify(gallery, rows, top_k)
         if min_dist >= User.dist_thresh:
             identity = None
         self.score = min_dist
         Logger(msg.Info.login_distance_func + f' {min_dist:.2f}', Logger.info).log()
         return identity
 
+    @staticmethod
+    def capture_template(user_img):
+        """
+        Embed the face of another frame of the user as an enrollment template
+        :param user_img: the captured frame
+        :return: the embedding of the frame's single face
+        """
+        faces = Image(user_img).embeddings_dict
+        if len(faces) != 1:
+            raise ValueError(msg.Errors.template_faces.format(len(faces)))
+        return next(iter(faces.values()))
+
+    def enroll(self, templates):
+        """
+        Add the user to the system with the captured templates
+        :param templates: the embeddings of the additional templates
+        """
+        self.uid = self.database.create_new_user(self)
+        for embedding in templates:
+            self.database.add_template(self.uid, embedding)
+
+    def cascade(self, gallery, rows: np.ndarray = None):
+        """
+        Prune gallery rows which cannot be the accepted match by scoring growing prefixes of the highest weight
+        dimensions. The embeddings are sigmoid outputs, so every remaining dimension adds between min(w, 0) and
+        max(w, 0) to the score, which bounds the final score of every row.
+        A row is pruned when its lower bound exceeds the best upper bound or reaches the distance threshold,
+        hence the decision of the exact scan over the survivors is identical to the decision over all rows
+        :param gallery: a Gallery object
+        :param rows: the rows to consider, all rows if not specified
+        :return: the surviving rows and the lowest lower bound of the pruned rows
+        """
+        weights, bias = self.engine.weights, self.engine.bias
+        probe = np.asarray(self.embedding, dtype=np.float32)
+
+        order = np.argsort(-np.abs(weights), kind='stable')
+        ordered = weights[order]
+        # the bounds of the remaining dimensions after each prefix
+        neg_rest = np.append(np.cumsum(np.minimum(ordered, 0)[::-1])[::-1], 0)
+        pos_rest = np.append(np.cumsum(np.maximum(ordered, 0)[::-1])[::-1], 0)
+
+        alive = np.arange(len(gallery)) if rows is None else np.asarray(rows)
+        partial = np.full(len(alive), bias, dtype=np.float32)
+        pruned_bound = np.inf
+        done = 0
+        self.cascade_stats = []
+        for stage in User.cascade_stages:
+            stage = min(stage, len(weights))
+            if len(alive) == 0 or stage <= done:
+                break
+            dims = order[done: stage]
+            partial += np.abs(gallery.take(alive, dims) - probe[dims]) @ weights[dims]
+            done = stage
+
+            lower = partial + neg_rest[done] - User.cascade_margin
+            upper = partial + pos_rest[done] + User.cascade_margin
+            keep = (lower <= upper.min()) & (lower < User.dist_thresh)
+            if not keep.all():
+                pruned_bound = min(pruned_bound, float(lower[~keep].min()))
+            self.cascade_stats.append((stage, len(alive), int(np.count_nonzero(~keep))))
+            alive, partial = alive[keep], partial[keep]
+        return alive, pruned_bound
+
+    def verify(self, claimed_uid: int):
+        """
+        Try to log in as a claimed user by scoring only that user's templates (1:1 verification)
+        :param claimed_uid: the claimed user ID
+        :return: if the user is the claimed user or not
+        """
+        embeddings = self.database.fetch_user_embeddings(claimed_uid)
+        if len(embeddings) == 0:
+            Logger(msg.Errors.unknown_user + f' - ID: {claimed_uid}', Logger.inform).log()
+            return False
+
+        templates = Gallery(embeddings.shape[1])
+        templates.load(np.full(len(embeddings), claimed_uid), embeddings)
+        self.uid = self.check_similarity(templates)
+        return self.uid is not None
+
     def login(self):
         """
         Try to log in with the current user
         :return: if the user is in the system or not
         """
-        data = self.database.fetch_users()
-        for i, user in enumerate(data):
-            data[i] = list(data[i])
-            data[i][1] = Init.database.byte_to_embedding(user[1])
-        self.uid = self.check_similarity(data)
+        rows = self.index.candidates(self.embedding) if User.use_index else None
+        if self.reduced is not None:
+            rows = self.reduced.shortlist(self.embedding, rows)
+        if User.aggregation != 'min' and rows is not None:
+            # the other aggregations need all the templates of the candidate users
+            rows = np.flatnonzero(np.isin(self.database.gallery.uids, self.database.gallery.uids[rows]))
+        if User.cascade_stages is None or User.aggregation != 'min':
+            self.uid = self.check_similarity(self.database.gallery, rows)
+            return self.uid is not None
+
+        rows, pruned_bound = self.cascade(self.database.gallery, rows)
+        for stage, candidates, pruned in self.cascade_stats:
+            Logger(msg.Info.cascade_stage.format(stage, candidates, pruned), Logger.info).log()
+        if len(rows) == 0 and np.isfinite(pruned_bound):
+            # every row was pruned by the distance threshold - no match, the lower bound is not a score of any user
+            self.uid, self.score, self.top_k = None, np.inf, []
+            Logger(msg.Info.cascade_no_match.format(pruned_bound), Logger.info).log()
+        else:
+            self.uid = self.check_similarity(self.database.gallery, rows)
         return self.uid is not None
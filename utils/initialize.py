@@ -1,40 +1,158 @@
-from facenet_pytorch import MTCNN
-import torch
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.messages import Messages as msg
 from database import Database as db
-from model.SNN import Net
+from model.detector import FaceDetector
 from model import config
+from search_index import IVFIndex
+from reduction import DimensionReduction, ReducedGallery
+from recognition_service import RecognitionClient, RemoteDetector, RemoteEngine
 from utils.logger import Logger
 
 
+class Component:
+    """
+    An object of Init built in the background. Reading it waits until it is ready (and raises if building it failed)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        future = Init.futures.get(self.name)
+        return None if future is None else future.result()
+
+
 class Init:
     """
-    This class represents all the objects the application needs to initialize and use
+    This class represents all the objects the application needs to initialize and use.
+    The objects are built concurrently in background threads, so the UI can start at once - reading an object
+    blocks only until that object is ready
     """
-    database = None
-    net = None
-    mtcnn = None
-    device = None
+    database = Component('database')
+    detector = Component('detector')
+    engine = Component('engine')
+    index = Component('index')
+    reduced = Component('reduced')
+    device = None       # the torch device, chosen once a torch model is built (torch is not loaded for ONNX)
+    futures = {}    # the future of every object by name
+    use_service = True  # use the running recognition service for the detection and the embeddings
+    service = None      # the RecognitionClient connected to the service
 
     @Logger(msg.Info.loading, level=Logger.info).time_it
     def __init__(self):
-        if Init.database is None:
-            # initiate the database object
-            Init.database = db()
+        if len(Init.futures) != 0:
+            return
+
+        if Init.use_service:
+            Init.service = RecognitionClient.connect()
+            Logger(msg.Info.service_connected, Logger.info, condition=Init.service is not None).log()
+        builders = {
+            'database': Init.__build_database,
+            'detector': Init.build_detector,
+            'engine': Init.build_engine,
+            'index': Init.__build_index,
+            'reduced': Init.__build_reduced,
+        }
+        # a worker per object - the objects depending on others wait for them inside their own worker
+        executor = ThreadPoolExecutor(max_workers=len(builders), thread_name_prefix='init')
+        for name, builder in builders.items():
+            timed = Logger(msg.Info.component_loaded.format(name), Logger.info).time_it(builder)
+            Init.futures[name] = executor.submit(timed)
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def ready(name: str) -> bool:
+        """
+        :param name: the object name
+        :return: if the object is built (successfully or not)
+        """
+        return name in Init.futures and Init.futures[name].done()
+
+    @staticmethod
+    def close():
+        """
+        Release the database so it is encrypted back
+        """
+        future = Init.futures.pop('database', None)
+        if future is not None:
+            future.exception()  # wait until it is built, the last reference is dropped on return
 
-        if Init.mtcnn is None:
-            # initiate the MTCNN network for later face detection
+    @staticmethod
+    def __build_database():
+        # initiate the database object
+        return db()
+
+    @staticmethod
+    def torch_device():
+        """
+        :return: the device the torch models run on
+        """
+        if Init.device is None:
+            import torch
             Init.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-            Init.mtcnn = MTCNN(
-                image_size=160, margin=0, min_face_size=20,
-                thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-                device=Init.device
-            )
-
-        if Init.net is None:
-            # load the model to be ready for use for face recognition
-            Init.net = Net()
-            state_dict = torch.load(config.MODEL_PATH)
-            Init.net.load_state_dict(state_dict)
+        return Init.device
+
+    @staticmethod
+    def build_detector():
+        """
+        :return: the face detector - the recognition service's if connected, else the backend chosen in the model
+            configurations
+        """
+        if Init.service is not None:
+            return RemoteDetector(Init.service, Init.build_local_detector)
+        return Init.build_local_detector()
+
+    @staticmethod
+    def build_local_detector():
+        """
+        :return: the in-process face detector of the backend chosen in the model configurations
+        """
+        return FaceDetector.create(config.DETECTOR, Init.torch_device() if config.DETECTOR != 'haar' else None)
+
+    @staticmethod
+    def build_engine():
+        """
+        :return: the inference engine - the recognition service's if connected, else the configured backend and model
+        """
+        if Init.service is not None:
+            return RemoteEngine(Init.service, Init.build_local_engine)
+        return Init.build_local_engine()
+
+    @staticmethod
+    def build_local_engine():
+        """
+        :return: the in-process inference engine of the configured backend and model
+        """
+        if config.INFERENCE_BACKEND == 'onnx':
+            # run the ONNX exports of the model with ONNX Runtime (optional dependency)
+            from model.onnx_engine import OnnxEngine
+            return OnnxEngine(config.ONNX_EMBED_PATH, config.ONNX_HEAD_PATH)
+
+        # load the model in evaluation mode to be ready for use for face recognition
+        from model.inference import InferenceEngine
+        return InferenceEngine.load(config.VARIANT_PATHS[config.INFERENCE_VARIANT], Init.torch_device(),
+                                    config.SCRIPTED_PATH if config.INFERENCE_VARIANT == 'float' else None)
+
+    @staticmethod
+    def __build_index():
+        # stamp the new embeddings with the model's fingerprint and warn if the stored ones came from another model
+        db.model_hash = db.model_fingerprint(Init.engine.weights)
+        foreign = Init.database.count_foreign_embeddings()
+        Logger(msg.Info.foreign_embeddings.format(foreign), Logger.warning, condition=foreign > 0).log()
+
+        # index the gallery by the model's head weights and follow the gallery's enrollments
+        index = IVFIndex(Init.engine.weights, Init.engine.bias)
+        index.attach(Init.database.gallery)
+        return index
 
+    @staticmethod
+    def __build_reduced():
+        if DimensionReduction.k is None:
+            return None
+        # keep a reduced copy of the gallery for cheap login scans
+        reduction = DimensionReduction(Init.engine.weights, Init.engine.bias, DimensionReduction.k,
+                                       DimensionReduction.mode, Init.database.gallery.embeddings())
+        reduced = ReducedGallery(reduction)
+        reduced.attach(Init.database.gallery)
+        return reduced
@@ -21,6 +21,17 @@ class Messages:
         access_denied = 'Access denied'
         failed_removal = 'File not in the system'
         unsupported_file_type = 'Unsupported file type'
+        unknown_user = 'No such user in the system'
+        invalid_uid = 'User ID should be a number'
+        verification_failed = 'The face does not match the claimed user'
+        path_conflict = 'The file {} (.{}) has the same Windows path as another file, migrated under the key {}'
+        service_lost = 'Lost the recognition service, continuing in process'
+        template_faces = 'Found {} faces, the enrollment pictures should show exactly one face - try again'
+        enrollment_failed = 'Could not capture the enrollment pictures, retake the picture and try again'
+        unsupported_sidecar_dtype = 'The embedding sidecar store supports only float32 and float16'
+        unknown_embedding_format = 'The stored embedding is of an unknown or newer format'
+        unknown_detector = 'Unknown face detector: {}'
+        unknown_variant = 'Unknown model variant: {}'
 
     class Info:
         """
@@ -41,6 +52,12 @@ class Messages:
         embeddings_generated = 'Face embeddings generated'
         faces_located = 'Faces located'
         loading = 'Loading and initiating the app'
+        component_loaded = 'Loaded the {}'
+        service_started = 'Recognition service listening on'
+        service_connected = 'Connected to the recognition service'
+        db_migration = 'Migrating the database to the current format'
+        blobs_collected = 'Removed {} unreferenced file backups'
+        foreign_embeddings = '{} stored embeddings were produced by another model, re-enroll these users'
         goodbye = 'Goodbye and thank you for using LockMe\n'
         exiting = 'Exiting'
         logging_off = 'logging-off the current user'
@@ -49,6 +66,11 @@ class Messages:
         user_deleted = 'User removed from the system'
         login_distance_func = 'Login with distance as confidence:'
         choose_ui = 'Do you want to continue using the terminal? [y/n]'
+        index_built = 'Gallery search index built'
+        cascade_stage = 'Scoring cascade - {} dimensions: {} candidates, {} pruned'
+        cascade_no_match = 'Scoring cascade - no match, every candidate scores at least {:.2f}'
+        more_templates = 'Capture another picture for the enrollment ({}/{})'
+        templates_capture = 'Keep looking at the camera, a few more pictures will be taken when you press OK'
 
         menu = f"""Available commands:
  > {KeyMap.add_cmd}      [{KeyMap.add}] -> add a new file to the system
@@ -73,6 +95,8 @@ class Messages:
         want_to_join = 'Hi there! you are not recognized by the system, would you like to join the system? [Y/n]'
         face_index = 'Please click on the user\'s face'
         delete_user = 'Are you sure you want to delete all user data? [y/N]'
+        claimed_uid = 'Enter your user ID to verify against it, or press enter to be identified:'
+        retry_template = 'The picture could not be used for the enrollment, would you like to take another one? [Y/n]'
 
     class Load:
         unlocking_files = f'{Logger.Colors.yellow}Unlock files'